@@ -0,0 +1,51 @@
+import functools
+
+from django.conf import settings
+from telegram.ext import ApplicationBuilder, CommandHandler
+
+from bot.handlers import start, crypto, deliverat, mytopics, subscribe, unsubscribe, stocks, news
+from bot.processing import PerChatUpdateProcessor
+from news_providers.http import close_async_http_client
+from news_providers.redis_client import close_shared_async_client
+from smart_bot.metrics import BOT_HANDLER_SECONDS
+
+COMMANDS = {
+    'start': start,
+    'subscribe': subscribe,
+    'unsubscribe': unsubscribe,
+    'crypto': crypto,
+    'mytopics': mytopics,
+    'deliverat': deliverat,
+    'stocks': stocks,
+    'news': news,
+}
+
+
+async def close_provider_clients(application):
+    """Close the pooled provider connections opened on the bot's event loop."""
+    await close_async_http_client()
+    await close_shared_async_client()
+
+
+def timed(command, callback):
+    """Record the handler's latency in BOT_HANDLER_SECONDS."""
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        with BOT_HANDLER_SECONDS.labels(command).time():
+            return await callback(update, context)
+    return wrapper
+
+
+def build_application(token=None):
+    """The bot's Application with every command handler, for polling and webhook mode alike."""
+    app = (
+        ApplicationBuilder()
+        .token(token or settings.BOT_TOKEN)
+        .base_url(settings.TELEGRAM_API_BASE_URL)
+        .concurrent_updates(PerChatUpdateProcessor(settings.BOT_CONCURRENT_UPDATES))
+        .post_shutdown(close_provider_clients)
+        .build()
+    )
+    for command, callback in COMMANDS.items():
+        app.add_handler(CommandHandler(command, timed(command, callback)))
+    return app
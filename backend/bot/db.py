@@ -0,0 +1,33 @@
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
+
+from smart_bot.dbpool import observe_pool_stats
+
+# sync_to_async's default (thread_sensitive=True) runs every ORM call on one shared
+# thread, so concurrent handlers would queue behind each other's queries. The bot uses
+# its own threads instead, sized to fit in the database connection pool.
+_executor = ThreadPoolExecutor(max_workers=settings.BOT_DB_THREADS, thread_name_prefix='bot-db')
+
+
+def _call(func, *args, **kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        # Like the end of a request: hands the connection back to the pool
+        # (and drops a broken one) instead of pinning it to this thread.
+        connection.close_if_unusable_or_obsolete()
+        # Sizes BOT_DB_THREADS and DB_POOL_MAX_SIZE against handler concurrency
+        observe_pool_stats()
+
+
+async def run_db(func, *args, **kwargs):
+    """Run a blocking ORM call on the bot's database thread pool."""
+    return await sync_to_async(
+        functools.partial(_call, func, *args, **kwargs),
+        thread_sensitive=False,
+        executor=_executor,
+    )()
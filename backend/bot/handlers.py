@@ -1,41 +1,28 @@
 from telegram import Update
 from telegram.ext import ContextTypes, CommandHandler
-from asgiref.sync import sync_to_async
+from django.db import IntegrityError
 import logging
 
-from users.models import CustomUser
 from subscriptions.models import Subscription
-from topics.models import Topic
 from bot.default_topics import DEFAULT_TOPICS
-from news_providers.crypto import get_crypto_trending
-from news_providers.stocks import get_stocks_trending
-from news_providers.news import get_news_trending
+from bot.db import run_db
+from bot.resolution import forget_user, resolve_topics, resolve_user
+from users.models import CustomUser, DELIVERY_SLOTS, delivery_slot_for
+from news_providers.crypto import aget_crypto_trending
+from news_providers.rendering import render_markdown
+from news_providers.stocks import aget_stock_quote, aget_stocks_trending
+from news_providers.news import aget_news_trending
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# Helper function to get or create user (DRY principle)
-async def get_user(telegram_id, username):
-    """Get or create user by telegram_id and username."""
-    try:
-        user, created = await sync_to_async(CustomUser.objects.get_or_create)(
-            telegram_id=telegram_id,
-            defaults={'username': username}
-        )
-        if created:
-            logger.info(f"New user created: {telegram_id} (@{username})")
-        return user, created
-    except Exception as e:
-        logger.error(f"Error getting/creating user {telegram_id}: {e}")
-        raise
-
 #Response on command /start
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         telegram_id = update.effective_user.id
         username = update.effective_user.username or f'user_{telegram_id}'
         
-        user, created = await get_user(telegram_id, username)
+        user_id, created = await resolve_user(telegram_id, username)
 
         if created:
             await update.message.reply_text("Welcome to Smart Bot! You have been successfully registered.")
@@ -47,38 +34,46 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Error in /start command: {e}", exc_info=True)
         await update.message.reply_text("Sorry, an error occurred. Please try again later.")
 
+def _topic_names(args):
+    """Topic names from command arguments: `/subscribe crypto stocks` or `/subscribe crypto,stocks`."""
+    return [name for arg in args for name in arg.split(',') if name]
+
 #Response on command /subscribe
 async def subscribe(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         telegram_id = update.effective_user.id
         username = update.effective_user.username or f'user_{telegram_id}'
 
-        user, created = await get_user(telegram_id, username)
+        user_id, created = await resolve_user(telegram_id, username)
 
-        if not context.args:
-            await update.message.reply_text("Please specify a topic to subscribe. Example: /subscribe crypto")
+        names = _topic_names(context.args)
+        if not names:
+            # Also covers arguments that are only commas, e.g. `/subscribe ,`
+            await update.message.reply_text("Please specify topics to subscribe. Example: /subscribe crypto stocks")
             return
 
-        topic_name = " ".join(context.args)
+        topics, unknown = await resolve_topics(names)
+        if unknown:
+            logger.warning(f"User {telegram_id} tried to subscribe to non-existent topics: {', '.join(unknown)}")
 
         try:
-            topic = await sync_to_async(Topic.objects.get)(name=topic_name)
-        except Topic.DoesNotExist:
-            logger.warning(f"User {telegram_id} tried to subscribe to non-existent topic: {topic_name}")
-            await update.message.reply_text(f"Topic '{topic_name}' does not exist.")
-            return
-
-        # Check if subscription already exists
-        exists = await sync_to_async(
-            lambda: Subscription.objects.filter(user=user, topic=topic).exists()
-        )()
-        if exists:
-            await update.message.reply_text(f"You are already subscribed to {topic.name}")
-            return
-
-        await sync_to_async(Subscription.objects.create)(user=user, topic=topic)
-        await update.message.reply_text(f"Successfully subscribed to {topic.name}")
-        logger.info(f"User {telegram_id} subscribed to topic: {topic.name}")
+            subscribed = await run_db(Subscription.objects.subscribe, user_id, topics.values())
+        except IntegrityError:
+            # The cached user was deleted meanwhile; resolve it again next time
+            forget_user(telegram_id)
+            raise
+
+        new = [name for name, topic_id in topics.items() if topic_id in subscribed]
+        already = [name for name, topic_id in topics.items() if topic_id not in subscribed]
+        lines = []
+        if new:
+            lines.append(f"Successfully subscribed to {', '.join(new)}")
+            logger.info(f"User {telegram_id} subscribed to topics: {', '.join(new)}")
+        if already:
+            lines.append(f"You are already subscribed to {', '.join(already)}")
+        if unknown:
+            lines.append(f"Topics that do not exist: {', '.join(unknown)}")
+        await update.message.reply_text('\n'.join(lines))
     except Exception as e:
         logger.error(f"Error in /subscribe command for user {update.effective_user.id}: {e}", exc_info=True)
         await update.message.reply_text("Sorry, an error occurred while subscribing. Please try again later.")
@@ -89,37 +84,74 @@ async def unsubscribe(update: Update, context: ContextTypes.DEFAULT_TYPE):
         telegram_id = update.effective_user.id
         username = update.effective_user.username or f'user_{telegram_id}'
 
-        user, created = await get_user(telegram_id, username)
-
-        if not context.args:
-            await update.message.reply_text("Specify topic to unsubscribe. Example: /unsubscribe crypto")
-            return
-
-        topic_name = ' '.join(context.args).lower()
-        try:
-            topic = await sync_to_async(Topic.objects.get)(name=topic_name)
-        except Topic.DoesNotExist:
-            logger.warning(f"User {telegram_id} tried to unsubscribe from non-existent topic: {topic_name}")
-            await update.message.reply_text(f"Topic '{topic_name}' does not exist.")
-            return
+        user_id, created = await resolve_user(telegram_id, username)
 
-        sub = await sync_to_async(Subscription.objects.filter(user=user, topic=topic).first)()
-        if not sub:
-            await update.message.reply_text(f"You are not subscribed to '{topic_name}'.")
+        names = _topic_names(context.args)
+        if not names:
+            await update.message.reply_text("Specify topics to unsubscribe. Example: /unsubscribe crypto stocks")
             return
 
-        await sync_to_async(sub.delete)()
-        await update.message.reply_text(f"Unsubscribed from '{topic_name}'.")
-        logger.info(f"User {telegram_id} unsubscribed from topic: {topic_name}")
+        topics, unknown = await resolve_topics(names)
+        if unknown:
+            logger.warning(f"User {telegram_id} tried to unsubscribe from non-existent topics: {', '.join(unknown)}")
+
+        removed = await run_db(Subscription.objects.unsubscribe, user_id, topics.values())
+
+        gone = [name for name, topic_id in topics.items() if topic_id in removed]
+        not_subscribed = [name for name, topic_id in topics.items() if topic_id not in removed]
+        lines = []
+        if gone:
+            lines.append(f"Unsubscribed from {', '.join(gone)}.")
+            logger.info(f"User {telegram_id} unsubscribed from topics: {', '.join(gone)}")
+        if not_subscribed:
+            lines.append(f"You are not subscribed to {', '.join(not_subscribed)}.")
+        if unknown:
+            lines.append(f"Topics that do not exist: {', '.join(unknown)}")
+        await update.message.reply_text('\n'.join(lines))
     except Exception as e:
         logger.error(f"Error in /unsubscribe command for user {update.effective_user.id}: {e}", exc_info=True)
         await update.message.reply_text("Sorry, an error occurred while unsubscribing. Please try again later.")
 
+#Response on command /deliverat
+async def deliverat(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        telegram_id = update.effective_user.id
+        username = update.effective_user.username or f'user_{telegram_id}'
+
+        user_id, created = await resolve_user(telegram_id, username)
+
+        minute = None
+        if context.args:
+            try:
+                minute = int(context.args[0])
+            except ValueError:
+                minute = -1
+            if not 0 <= minute < DELIVERY_SLOTS:
+                await update.message.reply_text(
+                    f"Specify a minute of the hour from 0 to {DELIVERY_SLOTS - 1}. Example: /deliverat 15"
+                )
+                return
+
+        slot = minute if minute is not None else delivery_slot_for(telegram_id)
+        await run_db(
+            CustomUser.objects.filter(pk=user_id).update,
+            preferred_delivery_minute=minute, delivery_slot=slot,
+        )
+
+        if minute is None:
+            await update.message.reply_text(f"Updates will arrive at a default minute of each hour (:{slot:02d} UTC).")
+        else:
+            await update.message.reply_text(f"Updates will arrive at :{slot:02d} past each hour (UTC).")
+        logger.info(f"User {telegram_id} set delivery slot {slot}")
+    except Exception as e:
+        logger.error(f"Error in /deliverat command for user {update.effective_user.id}: {e}", exc_info=True)
+        await update.message.reply_text("Sorry, an error occurred while saving your delivery time. Please try again later.")
+
 #Response on command /crypto
 async def crypto(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         logger.info(f"User {update.effective_user.id} requested /crypto")
-        trending = get_crypto_trending()
+        trending = await aget_crypto_trending()
         if not trending:
             await update.message.reply_text("No crypto data available at the moment. Please try again later.")
             return
@@ -131,8 +163,19 @@ async def crypto(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def stocks(update:Update, context: ContextTypes.DEFAULT_TYPE):
     try:
-        logger.info(f'User{update.effective_user_id} requested /stocks')
-        trending = get_stock_trending()
+        if context.args:
+            # `/stocks AAPL`: one tracked ticker, read from the per-symbol quote cache
+            symbol = context.args[0].upper()
+            logger.info(f"User {update.effective_user.id} requested /stocks {symbol}")
+            quote = await aget_stock_quote(symbol)
+            if quote is None:
+                await update.message.reply_text(f"No recent quote for {symbol}. Only tracked tickers are available.")
+                return
+            await update.message.reply_text(render_markdown((quote,))[0], parse_mode="Markdown")
+            return
+
+        logger.info(f"User {update.effective_user.id} requested /stocks")
+        trending = await aget_stocks_trending()
         if not trending:
             await update.message.reply_text("No stock data available at the moment. Please try again later.")
             return
@@ -144,8 +187,8 @@ async def stocks(update:Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def news(update:Update, context: ContextTypes.DEFAULT_TYPE):
     try:
-        logger.info(f'User{update.effective_user_id} requested /news')
-        trending = get_news_trending()
+        logger.info(f"User {update.effective_user.id} requested /news")
+        trending = await aget_news_trending()
         if not trending:
             await update.message.reply_text("No news data available at the moment. Please try again later.")
             return
@@ -162,10 +205,10 @@ async def mytopics(update: Update, context: ContextTypes.DEFAULT_TYPE):
         telegram_id = update.effective_user.id
         username = update.effective_user.username or f'user_{telegram_id}'
 
-        user, created = await get_user(telegram_id, username)
-        
-        user_topics = await sync_to_async(list)(
-            Subscription.objects.filter(user=user).select_related('topic')
+        user_id, created = await resolve_user(telegram_id, username)
+
+        user_topics = await run_db(
+            list, Subscription.objects.filter(user_id=user_id).values_list('topic__name', flat=True)
         )
 
         if not user_topics:
@@ -173,7 +216,7 @@ async def mytopics(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         topics_text = "\n".join(
-            [f"- {sub.topic.name}" for sub in user_topics]
+            [f"- {topic_name}" for topic_name in user_topics]
         )
 
         await update.message.reply_text(
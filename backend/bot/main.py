@@ -1,3 +1,4 @@
+import asyncio
 import sys
 import django
 import os
@@ -8,14 +9,36 @@ backend_dir = Path(__file__).resolve().parent.parent
 sys.path.insert(0, str(backend_dir))
 
 from django.conf import settings
+from prometheus_client import start_http_server
 from telegram import Update
-from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'smart_bot.settings')
 django.setup()
 
 # Import handlers AFTER django.setup() because they use Django models
-from bot.handlers import start, crypto, mytopics, subscribe, unsubscribe, stocks, news
+from bot.application import build_application
+from smart_bot.metrics import collector_registry
+
+async def set_webhook(app, force=False):
+    """
+    Point Telegram at our webhook; the updates themselves are served by smart_bot.asgi.
+
+    Nothing is sent when Telegram already has this URL, so restarts do not call
+    setWebhook again. Telegram does not report the secret: pass force=True
+    (`python bot/main.py --force`) after changing it.
+    """
+    url = settings.BOT_WEBHOOK_URL.rstrip('/') + settings.BOT_WEBHOOK_PATH
+    async with app.bot:
+        if not force and (await app.bot.get_webhook_info()).url == url:
+            print(f"Webhook already set to {url}")
+            return
+        await app.bot.set_webhook(
+            url=url,
+            secret_token=settings.BOT_WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=settings.BOT_WEBHOOK_MAX_CONNECTIONS,
+        )
+    print(f"Webhook set to {url}")
 
 def main():
     TOKEN = settings.BOT_TOKEN
@@ -23,17 +46,21 @@ def main():
         print("Error: BOT_TOKEN environment variable is not set!")
         sys.exit(1)
     
-    app = ApplicationBuilder().token(TOKEN).build()
-    app.add_handler(CommandHandler('start', start))
-    app.add_handler(CommandHandler('subscribe', subscribe))
-    app.add_handler(CommandHandler('unsubscribe', unsubscribe))
-    app.add_handler(CommandHandler('crypto', crypto))
-    app.add_handler(CommandHandler('mytopics', mytopics))
-    app.add_handler(CommandHandler('stocks', stocks))
-    app.add_handler(CommandHandler('news', news))
-    
+    app = build_application(TOKEN)
+
+    if settings.BOT_MODE == 'webhook':
+        if not settings.BOT_WEBHOOK_URL or not settings.BOT_WEBHOOK_SECRET:
+            print("Error: BOT_WEBHOOK_URL and BOT_WEBHOOK_SECRET must be set in webhook mode!")
+            sys.exit(1)
+        asyncio.run(set_webhook(app, force='--force' in sys.argv[1:]))
+        return
+
+    if settings.BOT_METRICS_PORT:
+        start_http_server(settings.BOT_METRICS_PORT, registry=collector_registry())
+
+    # Polling removes any registered webhook first
     print("Bot started. Polling...")
     app.run_polling()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,48 @@
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Process up to `max_concurrent_updates` updates at once, one at a time per chat.
+
+    Updates from different chats run concurrently; updates from the same chat
+    wait on that chat's lock, which asyncio hands over in arrival order.
+
+    Ordering holds within one process. In webhook mode with several uvicorn
+    workers, Telegram's requests for one chat may reach different workers, so
+    their updates can run out of order.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._chat_locks = {}  # chat id -> [lock, number of updates holding or waiting]
+
+    async def process_update(self, update, coroutine):
+        # The base class takes a concurrency slot before do_process_update(); waiting for
+        # the chat first keeps one chat's backlog from holding every slot
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            await super().process_update(update, coroutine)
+            return
+
+        entry = self._chat_locks.setdefault(chat.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chat_locks[chat.id]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
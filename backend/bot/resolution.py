@@ -0,0 +1,70 @@
+import logging
+
+from django.conf import settings
+
+from bot.db import run_db
+from news_providers.cache import LRUCache, ensure_invalidation_listener, register_local_cache
+from topics.models import Topic
+from topics.signals import TOPIC_TABLE_KEY
+from users.models import CustomUser
+from users.signals import user_cache_key
+
+logger = logging.getLogger(__name__)
+
+# Both caches are kept in sync with other processes through the provider cache's
+# invalidation channel: deleting a user or saving/deleting a topic drops the entry.
+_users = LRUCache(settings.BOT_USER_CACHE_SIZE, settings.BOT_USER_CACHE_TTL)
+_topics = LRUCache(1, settings.BOT_TOPIC_CACHE_TTL)
+register_local_cache(_users)
+register_local_cache(_topics)
+
+
+async def resolve_user(telegram_id, username):
+    """Return (user pk, created) for a Telegram user; a cache hit costs no query."""
+    ensure_invalidation_listener()
+    key = user_cache_key(telegram_id)
+    user_id = _users.get(key)
+    if user_id is not None:
+        return user_id, False
+
+    user, created = await run_db(
+        CustomUser.objects.get_or_create,
+        telegram_id=telegram_id,
+        defaults={'username': username}
+    )
+    if created:
+        logger.info(f"New user created: {telegram_id} (@{username})")
+    _users.set(key, user.pk)
+    return user.pk, created
+
+
+def forget_user(telegram_id):
+    """Drop a cached user pk, e.g. after a write failed because the user is gone."""
+    _users.invalidate(user_cache_key(telegram_id))
+
+
+async def topic_table():
+    """Topic name -> id for every topic, loaded once and reloaded after a change."""
+    ensure_invalidation_listener()
+    table = _topics.get(TOPIC_TABLE_KEY)
+    if table is None:
+        table = await run_db(lambda: dict(Topic.objects.values_list('name', 'id')))
+        _topics.set(TOPIC_TABLE_KEY, table)
+    return table
+
+
+async def resolve_topics(names):
+    """
+    Match topic names case-insensitively against the cached topic table.
+
+    Returns ({topic name: id} for known topics, [unknown names]), in the order given.
+    """
+    by_name = {name.lower(): (name, topic_id) for name, topic_id in (await topic_table()).items()}
+    found, unknown = {}, []
+    for name in names:
+        match = by_name.get(name.lower())
+        if match:
+            found[match[0]] = match[1]
+        elif name not in unknown:
+            unknown.append(name)
+    return found, unknown
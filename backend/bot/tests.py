@@ -0,0 +1,295 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from telegram import Update
+
+from bot import handlers, resolution, webhook
+from bot.processing import PerChatUpdateProcessor
+from bot.webhook import MAX_BODY_SIZE, TelegramWebhook
+from news_providers import records
+from news_providers.records import Quote
+from news_providers.redis_client import close_shared_async_client, r
+from news_providers.stocks import QUOTE_CACHE_KEY
+from topics.models import Topic
+from users.models import CustomUser, delivery_slot_for
+
+SECRET = 'test-secret'
+
+
+class FakeApplication:
+    bot = None
+
+    def __init__(self):
+        self.running = False
+        self.update_queue = asyncio.Queue()
+
+    async def initialize(self):
+        pass
+
+    async def start(self):
+        self.running = True
+
+    async def stop(self):
+        self.running = False
+
+    async def shutdown(self):
+        pass
+
+
+class TelegramWebhookTests(SimpleTestCase):
+    def setUp(self):
+        self.application = FakeApplication()
+        self.webhook = TelegramWebhook(self.application, SECRET)
+
+    async def _request(self, body=b'', method='POST', secret=SECRET, chunk_size=None):
+        headers = [(b'content-type', b'application/json')]
+        if secret is not None:
+            headers.append((webhook.SECRET_TOKEN_HEADER, secret.encode()))
+        chunk_size = chunk_size or max(len(body), 1)
+        chunks = [body[start:start + chunk_size] for start in range(0, max(len(body), 1), chunk_size)]
+        messages = [
+            {'type': 'http.request', 'body': chunk, 'more_body': index < len(chunks) - 1}
+            for index, chunk in enumerate(chunks)
+        ]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        await self.webhook({'type': 'http', 'method': method, 'headers': headers, 'client': None}, receive, send)
+        return sent[0]['status']
+
+    async def test_update_is_queued(self):
+        status = await self._request(json.dumps({'update_id': 7}).encode())
+        self.assertEqual(status, 200)
+        update = self.application.update_queue.get_nowait()
+        self.assertIsInstance(update, Update)
+        self.assertEqual(update.update_id, 7)
+        self.assertTrue(self.application.running)
+
+    async def test_only_post_is_allowed(self):
+        self.assertEqual(await self._request(method='GET'), 405)
+
+    async def test_missing_or_wrong_secret_is_rejected(self):
+        self.assertEqual(await self._request(b'{}', secret=None), 403)
+        self.assertEqual(await self._request(b'{}', secret='wrong'), 403)
+        self.assertTrue(self.application.update_queue.empty())
+
+    async def test_oversized_body_is_rejected(self):
+        body = b'{"update_id": 1, "padding": "' + b'x' * MAX_BODY_SIZE + b'"}'
+        self.assertEqual(await self._request(body, chunk_size=64 * 1024), 413)
+
+    async def test_malformed_or_non_object_json_is_rejected(self):
+        for body in (b'{not json', b'[]', b'"update"', b'null', b'', b'{"foo": 1}', b'{}'):
+            with self.subTest(body=body):
+                self.assertEqual(await self._request(body), 400)
+        self.assertTrue(self.application.update_queue.empty())
+
+    async def test_invalid_update_is_rejected(self):
+        for update in ({'update_id': '7'}, {'update_id': True}, {'update_id': None},
+                       {'update_id': 7, 'message': 'text'}, {'update_id': 7, 'message': {'chat': {'id': 1}}}):
+            with self.subTest(update=update):
+                self.assertEqual(await self._request(json.dumps(update).encode()), 400)
+        self.assertTrue(self.application.update_queue.empty())
+        self.assertFalse(self.application.running)
+
+    async def test_lifespan_shutdown_closes_provider_clients(self):
+        await self.webhook.startup()
+        with mock.patch.object(webhook, 'close_provider_clients') as close:
+            await self.webhook.shutdown()
+        close.assert_awaited_once_with(self.application)
+        self.assertFalse(self.application.running)
+
+
+class FakeMessage:
+    def __init__(self):
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+
+def _command(telegram_id, *args):
+    """A (update, context) pair for a command sent by `telegram_id` with `args`."""
+    update = SimpleNamespace(effective_user=SimpleNamespace(id=telegram_id, username=None), message=FakeMessage())
+    return update, SimpleNamespace(args=list(args))
+
+
+# Handlers query on the bot's own database threads, so the data has to be committed
+class DeliverAtCommandTests(TransactionTestCase):
+    def setUp(self):
+        resolution._users.clear()
+        self.addCleanup(resolution._users.clear)
+
+    async def _deliverat(self, *args):
+        update, context = _command(1001, *args)
+        await handlers.deliverat(update, context)
+        return update.message.replies[-1]
+
+    async def _user(self):
+        return await CustomUser.objects.aget(telegram_id='1001')
+
+    async def test_minute_overrides_the_hashed_slot(self):
+        self.assertIn(':15', await self._deliverat('15'))
+        user = await self._user()
+        self.assertEqual((user.preferred_delivery_minute, user.delivery_slot), (15, 15))
+
+    async def test_no_minute_restores_the_hashed_slot(self):
+        await self._deliverat('15')
+        await self._deliverat()
+        user = await self._user()
+        self.assertEqual((user.preferred_delivery_minute, user.delivery_slot), (None, delivery_slot_for(1001)))
+
+    async def test_invalid_minute_is_rejected(self):
+        await self._deliverat('15')
+        for arg in ('60', '-1', 'soon'):
+            with self.subTest(arg=arg):
+                self.assertIn('from 0 to 59', await self._deliverat(arg))
+        user = await self._user()
+        self.assertEqual((user.preferred_delivery_minute, user.delivery_slot), (15, 15))
+
+
+async def run_db_on_test_thread(func, *args, **kwargs):
+    """run_db() on the test's own connection, so its transaction and assertNumQueries see the queries."""
+    return await sync_to_async(func)(*args, **kwargs)
+
+
+class ResolutionTests(TestCase):
+    def setUp(self):
+        for cache in (resolution._users, resolution._topics):
+            cache.clear()
+            self.addCleanup(cache.clear)
+        for module in (handlers, resolution):
+            patcher = mock.patch.object(module, 'run_db', run_db_on_test_thread)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.crypto = Topic.objects.create(name='crypto')
+        self.stocks = Topic.objects.create(name='stocks')
+
+    def _send(self, command, *args):
+        update, context = _command(1001, *args)
+        async_to_sync(command)(update, context)
+        return update.message.replies[-1]
+
+    def test_resolve_user_creates_once_then_hits_the_cache(self):
+        user_id, created = async_to_sync(resolution.resolve_user)(1001, 'reader')
+        self.assertTrue(created)
+        with self.assertNumQueries(0):
+            self.assertEqual(async_to_sync(resolution.resolve_user)(1001, 'reader'), (user_id, False))
+        self.assertEqual(CustomUser.objects.get(pk=user_id).telegram_id, '1001')
+
+    def test_resolve_topics_matches_names_case_insensitively(self):
+        topics, unknown = async_to_sync(resolution.resolve_topics)(['STOCKS', 'weather', 'Crypto', 'weather'])
+        self.assertEqual(topics, {'stocks': self.stocks.pk, 'crypto': self.crypto.pk})
+        self.assertEqual(unknown, ['weather'])
+        with self.assertNumQueries(0):
+            async_to_sync(resolution.resolve_topics)(['crypto'])
+
+    def test_topic_table_is_dropped_when_a_topic_is_saved(self):
+        self.assertEqual(async_to_sync(resolution.resolve_topics)(['news']), ({}, ['news']))
+        news = Topic.objects.create(name='news')
+        self.assertEqual(async_to_sync(resolution.resolve_topics)(['news']), ({'news': news.pk}, []))
+
+    def test_cached_subscribe_runs_one_query(self):
+        self._send(handlers.subscribe, 'crypto')
+        with self.assertNumQueries(1):
+            reply = self._send(handlers.subscribe, 'crypto,stocks', 'weather')
+        self.assertEqual(reply.splitlines(), [
+            'Successfully subscribed to stocks',
+            'You are already subscribed to crypto',
+            'Topics that do not exist: weather',
+        ])
+
+    def test_cached_unsubscribe_runs_one_query(self):
+        self._send(handlers.subscribe, 'crypto')
+        with self.assertNumQueries(1):
+            reply = self._send(handlers.unsubscribe, 'crypto', 'stocks')
+        self.assertEqual(reply.splitlines(), ['Unsubscribed from crypto.', 'You are not subscribed to stocks.'])
+
+
+class StockQuoteCommandTests(SimpleTestCase):
+    def setUp(self):
+        key = QUOTE_CACHE_KEY.format(symbol='AAPL')
+        r.set(key, records.pack((Quote('AAPL', 'Apple Inc.', 110.0, 100.0),), 0))
+        self.addCleanup(r.delete, key)
+
+    async def _stocks(self, *args):
+        update, context = _command(1001, *args)
+        try:
+            await handlers.stocks(update, context)
+        finally:
+            await close_shared_async_client()
+        return update.message.replies[-1]
+
+    async def test_cached_quote_is_shown(self):
+        reply = await self._stocks('aapl')
+        self.assertIn('*Apple Inc.* (AAPL)', reply)
+        self.assertIn('+10.00%', reply)
+
+    async def test_untracked_symbol_has_no_quote(self):
+        self.assertEqual(await self._stocks('zzzz'), 'No recent quote for ZZZZ. Only tracked tickers are available.')
+
+
+def _chat_update(update_id, chat_id):
+    return Update.de_json({'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': 0, 'chat': {'id': chat_id, 'type': 'private'}, 'text': '/news',
+    }}, None)
+
+
+class PerChatUpdateProcessorTests(SimpleTestCase):
+    def setUp(self):
+        self.events = []
+        self.running = 0
+        self.most_running = 0
+
+    async def _handle(self, name, delay=0.0, wait_for=None):
+        self.running += 1
+        self.most_running = max(self.most_running, self.running)
+        self.events.append(f'start {name}')
+        if wait_for is not None:
+            await wait_for.wait()
+        await asyncio.sleep(delay)
+        self.events.append(f'end {name}')
+        self.running -= 1
+
+    async def test_same_chat_updates_run_one_at_a_time_in_arrival_order(self):
+        processor = PerChatUpdateProcessor(8)
+        # Earlier updates take longer, so any overlap would reorder them
+        await asyncio.gather(*(
+            processor.process_update(_chat_update(index, 1), self._handle(index, delay=0.03 * (3 - index)))
+            for index in range(3)
+        ))
+        self.assertEqual(self.events, ['start 0', 'end 0', 'start 1', 'end 1', 'start 2', 'end 2'])
+        self.assertEqual(processor._chat_locks, {})
+
+    async def test_other_chats_run_concurrently(self):
+        processor = PerChatUpdateProcessor(8)
+        started = time.monotonic()
+        await asyncio.gather(*(
+            processor.process_update(_chat_update(chat_id, chat_id), self._handle(chat_id, delay=0.1))
+            for chat_id in range(4)
+        ))
+        self.assertEqual(self.most_running, 4)
+        self.assertLess(time.monotonic() - started, 0.3)
+
+    async def test_a_chat_backlog_does_not_hold_concurrency_slots(self):
+        processor = PerChatUpdateProcessor(2)
+        release = asyncio.Event()
+        backlog = [
+            asyncio.create_task(processor.process_update(_chat_update(index, 1), self._handle(index, wait_for=release)))
+            for index in range(5)
+        ]
+        # Chat 2 gets a slot although five updates of chat 1 are queued ahead of it
+        await asyncio.wait_for(processor.process_update(_chat_update(10, 2), self._handle(10)), 1)
+        self.assertEqual(self.events, ['start 0', 'start 10', 'end 10'])
+        release.set()
+        await asyncio.gather(*backlog)
+        self.assertEqual(self.most_running, 2)
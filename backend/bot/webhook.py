@@ -0,0 +1,135 @@
+import asyncio
+import hmac
+import json
+import logging
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from telegram import Update
+
+from bot.application import build_application, close_provider_clients
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = b'x-telegram-bot-api-secret-token'
+MAX_BODY_SIZE = 1024 * 1024  # Telegram updates are a few KB at most
+
+
+class TelegramWebhook:
+    """
+    ASGI app that receives Telegram updates and hands them to the bot's Application.
+
+    Requests must carry the BOT_WEBHOOK_SECRET in Telegram's secret token header.
+    Updates are only queued here and acknowledged right away; the Application
+    processes them in the background. Each server worker runs its own Application,
+    so the webhook scales with the number of workers.
+    """
+
+    def __init__(self, application=None, secret_token=None):
+        self.secret_token = (secret_token or settings.BOT_WEBHOOK_SECRET or '').encode()
+        if not self.secret_token:
+            raise ImproperlyConfigured("BOT_WEBHOOK_SECRET must be set to serve the Telegram webhook")
+        self.application = application or build_application()
+        self._start_lock = None
+
+    async def startup(self):
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if not self.application.running:
+                await self.application.initialize()
+                await self.application.start()
+                logger.info("Telegram webhook application started")
+
+    async def shutdown(self):
+        if self.application.running:
+            await self.application.stop()
+            await self.application.shutdown()
+            # post_shutdown hooks only run under run_polling()/run_webhook()
+            await close_provider_clients(self.application)
+            logger.info("Telegram webhook application stopped")
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._handle(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as e:
+                    logger.error(f"Telegram webhook startup failed: {e}", exc_info=True)
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _handle(self, scope, receive, send):
+        if scope['method'] != 'POST':
+            await _respond(send, 405)
+            return
+
+        headers = dict(scope['headers'])
+        if not hmac.compare_digest(headers.get(SECRET_TOKEN_HEADER, b''), self.secret_token):
+            logger.warning(f"Rejected webhook request from {scope.get('client')}: bad secret token")
+            await _respond(send, 403)
+            return
+
+        body = await _read_body(receive)
+        if body is None:
+            await _respond(send, 413)
+            return
+
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = None
+        update = _parse_update(data, self.application.bot)
+        if update is None:
+            await _respond(send, 400)
+            return
+
+        # Covers servers started without lifespan support
+        await self.startup()
+        await self.application.update_queue.put(update)
+        await _respond(send, 200)
+
+
+def _parse_update(data, bot):
+    """The Update in a decoded request body, or None if the body is not a valid update."""
+    # bool is an int subclass, but never a valid update id
+    if not isinstance(data, dict) or type(data.get('update_id')) is not int:
+        return None
+    try:
+        return Update.de_json(data, bot)
+    except Exception as e:
+        logger.warning(f"Rejected malformed webhook update {data['update_id']}: {e}")
+        return None
+
+
+async def _read_body(receive):
+    """The request body, or None once it grows past MAX_BODY_SIZE."""
+    body = bytearray()
+    while True:
+        message = await receive()
+        body.extend(message.get('body', b''))
+        if len(body) > MAX_BODY_SIZE:
+            return None
+        if not message.get('more_body'):
+            return bytes(body)
+
+
+async def _respond(send, status):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'text/plain'), (b'content-length', b'0')],
+    })
+    await send({'type': 'http.response.body', 'body': b''})
@@ -0,0 +1,422 @@
+import asyncio
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+
+from news_providers import circuit as breaker
+from news_providers import records
+from news_providers.circuit import CircuitOpenError
+from news_providers.redis_client import r, shared_async_client
+from smart_bot.metrics import PROVIDER_CACHE_REQUESTS, metric_key, observe_fetch
+
+logger = logging.getLogger(__name__)
+
+LOCK_TTL = 30  # seconds a refresh may hold the lock
+WAIT_TIMEOUT = 10  # seconds a cold-cache caller waits for another caller's refresh
+WAIT_INTERVAL = 0.1
+
+INVALIDATION_CHANNEL = 'news_providers:invalidate'
+INSTANCE_ID = uuid.uuid4().hex  # tells our own invalidation messages apart from other processes'
+
+
+class LRUCache:
+    """Thread-safe, size-bounded LRU whose entries expire `ttl` seconds after being set."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# L1: in-process copy of recent provider payloads in front of Redis (L2)
+l1 = LRUCache(settings.PROVIDER_L1_MAXSIZE, settings.PROVIDER_L1_TTL)
+_local_caches = [l1]  # every in-process cache the invalidation listener keeps in sync
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+
+def _listen_for_invalidations():
+    while True:
+        try:
+            pubsub = r.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            # Messages may have been missed while (re)connecting
+            for cache in _local_caches:
+                cache.clear()
+            for message in pubsub.listen():
+                sender, _, key = message['data'].decode().partition(' ')
+                if sender != INSTANCE_ID:
+                    for cache in _local_caches:
+                        cache.invalidate(key)
+        except Exception as e:
+            logger.warning(f"Cache invalidation listener disconnected: {e}")
+            time.sleep(1)
+
+
+def ensure_invalidation_listener():
+    """Start the invalidation listener once per process (again after a fork)."""
+    global _listener_pid
+    if _listener_pid == os.getpid():
+        return
+    with _listener_lock:
+        if _listener_pid != os.getpid():
+            threading.Thread(
+                target=_listen_for_invalidations, name='provider-cache-invalidation', daemon=True
+            ).start()
+            _listener_pid = os.getpid()
+
+
+def register_local_cache(cache):
+    """Have the invalidation listener drop keys from `cache` too."""
+    _local_caches.append(cache)
+
+
+def _invalidation_message(key):
+    return f'{INSTANCE_ID} {key}'
+
+
+def publish_invalidation(key):
+    """Drop `key` from the in-process caches here and in every other process."""
+    for cache in _local_caches:
+        cache.invalidate(key)
+    try:
+        r.publish(INVALIDATION_CHANNEL, _invalidation_message(key))
+    except Exception as e:
+        logger.warning(f"Could not publish invalidation of {key}: {e}")
+
+
+# Delete the lock only if it still holds our token, so a slow refresh never frees someone else's lock
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+_release_lock = r.register_script(RELEASE_LOCK_SCRIPT)
+
+
+def _lock_key(key):
+    return f'{key}:lock'
+
+
+def _acquire_lock(key):
+    token = uuid.uuid4().hex
+    if r.set(_lock_key(key), token, nx=True, ex=LOCK_TTL):
+        return token
+    return None
+
+
+def _read(key):
+    """Return (value, age in seconds) or (None, None) on a miss."""
+    return _decode(key, r.get(key))
+
+
+def _decode(key, raw):
+    if raw is None:
+        return None, None
+    try:
+        value, fetched_at = records.unpack(raw)
+    except Exception as e:
+        # Entry written in an older format; treat it as a miss and let it be replaced
+        logger.warning(f"Unreadable cache entry for {key}: {e}")
+        return None, None
+    return value, time.time() - fetched_at
+
+
+def _lkg_key(key):
+    return f'{key}:lkg'
+
+
+def _count(key, result):
+    PROVIDER_CACHE_REQUESTS.labels(metric_key(key), result).inc()
+
+
+def _lookup_result(value, force_refresh):
+    if force_refresh:
+        return 'refresh'
+    return 'miss' if value is None else 'stale'
+
+
+def _store(key, value, hard_ttl):
+    """Write a fresh entry plus its long-lived last-known-good copy and announce it."""
+    payload = records.pack(value, time.time())
+    with r.pipeline(transaction=False) as pipe:
+        pipe.set(key, payload, ex=hard_ttl)
+        pipe.set(_lkg_key(key), payload, ex=settings.PROVIDER_LKG_TTL)
+        pipe.publish(INVALIDATION_CHANNEL, _invalidation_message(key))
+        pipe.execute()
+
+
+def _refresh(key, fetch, hard_ttl, token, circuit=None):
+    try:
+        if circuit and not breaker.allow(circuit):
+            raise CircuitOpenError(circuit)
+        try:
+            with observe_fetch(metric_key(key)):
+                value = tuple(fetch())
+        except Exception as e:
+            if circuit:
+                breaker.record_failure(circuit, e)
+            raise
+        if circuit:
+            breaker.record_success(circuit)
+        _store(key, value, hard_ttl)
+        logger.info(f"New data fetched for {key}")
+        return value
+    finally:
+        _release_lock(keys=[_lock_key(key)], args=[token])
+
+
+def _last_known_good(key, error):
+    """Serve the last successful payload once the regular entry is gone, or re-raise `error`."""
+    value, _ = _decode(_lkg_key(key), r.get(_lkg_key(key)))
+    if value is None:
+        raise error
+    _count(key, 'last_known_good')
+    logger.warning(f"Serving last known good data for {key}: {error}")
+    return value
+
+
+def get_or_refresh(key, fetch, soft_ttl, hard_ttl, force_refresh=False, circuit=None):
+    """
+    Stale-while-revalidate read of `key`, a tuple of provider records.
+
+    Fresh entries (younger than `soft_ttl`) are returned as is. Stale ones are
+    refreshed by exactly one caller holding a Redis SET NX lock while every other
+    caller keeps getting the stale value. Entries expire after `hard_ttl`; on a
+    cold miss other callers wait briefly for the lock holder instead of all
+    hitting the upstream API.
+
+    With `circuit` set, refreshes go through that provider's circuit breaker.
+    While it is open, or when a refresh fails, callers get the stale entry or
+    the last known good payload; exceptions propagate only when neither exists.
+    """
+    value, age = _read(key)
+    if value is not None and age < soft_ttl and not force_refresh:
+        _count(key, 'hit')
+        logger.debug(f"Using cached data for {key}")
+        return value
+    _count(key, _lookup_result(value, force_refresh))
+
+    token = _acquire_lock(key)
+    if token is None:
+        if value is not None:
+            logger.debug(f"Serving stale data for {key} while another caller refreshes it")
+            return value
+        return _wait_for_refresh(key, fetch, hard_ttl, circuit)
+
+    try:
+        return _refresh(key, fetch, hard_ttl, token, circuit)
+    except Exception as e:
+        if value is None:
+            return _last_known_good(key, e)
+        logger.warning(f"Refresh of {key} failed, serving stale data: {e}")
+        return value
+
+
+def _wait_for_refresh(key, fetch, hard_ttl, circuit):
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_INTERVAL)
+        value, _ = _read(key)
+        if value is not None:
+            return value
+        token = _acquire_lock(key)
+        if token is not None:
+            # The previous holder gave up without storing anything; take over
+            try:
+                return _refresh(key, fetch, hard_ttl, token, circuit)
+            except Exception as e:
+                return _last_known_good(key, e)
+
+    return _last_known_good(key, TimeoutError(f"Timed out waiting for refresh of {key}"))
+
+
+# Async variants for the bot: same protocol and keys, on redis.asyncio
+
+async def _aacquire_lock(client, key):
+    token = uuid.uuid4().hex
+    if await client.set(_lock_key(key), token, nx=True, ex=LOCK_TTL):
+        return token
+    return None
+
+
+async def _astore(client, key, value, hard_ttl):
+    payload = records.pack(value, time.time())
+    async with client.pipeline(transaction=False) as pipe:
+        pipe.set(key, payload, ex=hard_ttl)
+        pipe.set(_lkg_key(key), payload, ex=settings.PROVIDER_LKG_TTL)
+        pipe.publish(INVALIDATION_CHANNEL, _invalidation_message(key))
+        await pipe.execute()
+
+
+async def _arefresh(client, key, afetch, hard_ttl, token, circuit=None):
+    try:
+        if circuit and not await breaker.aallow(circuit):
+            raise CircuitOpenError(circuit)
+        try:
+            with observe_fetch(metric_key(key)):
+                value = tuple(await afetch())
+        except Exception as e:
+            if circuit:
+                await breaker.arecord_failure(circuit, e)
+            raise
+        if circuit:
+            await breaker.arecord_success(circuit)
+        await _astore(client, key, value, hard_ttl)
+        logger.info(f"New data fetched for {key}")
+        return value
+    finally:
+        await client.eval(RELEASE_LOCK_SCRIPT, 1, _lock_key(key), token)
+
+
+async def _alast_known_good(client, key, error):
+    value, _ = _decode(_lkg_key(key), await client.get(_lkg_key(key)))
+    if value is None:
+        raise error
+    _count(key, 'last_known_good')
+    logger.warning(f"Serving last known good data for {key}: {error}")
+    return value
+
+
+async def aget_or_refresh(key, afetch, soft_ttl, hard_ttl, force_refresh=False, circuit=None):
+    """Async get_or_refresh(); `afetch` is a coroutine function."""
+    client = shared_async_client()
+    value, age = _decode(key, await client.get(key))
+    if value is not None and age < soft_ttl and not force_refresh:
+        _count(key, 'hit')
+        logger.debug(f"Using cached data for {key}")
+        return value
+    _count(key, _lookup_result(value, force_refresh))
+
+    token = await _aacquire_lock(client, key)
+    if token is None:
+        if value is not None:
+            logger.debug(f"Serving stale data for {key} while another caller refreshes it")
+            return value
+        return await _await_refresh(client, key, afetch, hard_ttl, circuit)
+
+    try:
+        return await _arefresh(client, key, afetch, hard_ttl, token, circuit)
+    except Exception as e:
+        if value is None:
+            return await _alast_known_good(client, key, e)
+        logger.warning(f"Refresh of {key} failed, serving stale data: {e}")
+        return value
+
+
+async def _await_refresh(client, key, afetch, hard_ttl, circuit):
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(WAIT_INTERVAL)
+        value, _ = _decode(key, await client.get(key))
+        if value is not None:
+            return value
+        token = await _aacquire_lock(client, key)
+        if token is not None:
+            try:
+                return await _arefresh(client, key, afetch, hard_ttl, token, circuit)
+            except Exception as e:
+                return await _alast_known_good(client, key, e)
+
+    return await _alast_known_good(client, key, TimeoutError(f"Timed out waiting for refresh of {key}"))
+
+
+def _key_builder(prefix, func):
+    signature = inspect.signature(func)
+
+    def build(args, kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        if not bound.arguments:
+            return prefix
+        return prefix + ':' + ','.join(f'{name}={value}' for name, value in bound.arguments.items())
+
+    return build
+
+
+def provider_cache(prefix, soft_ttl, hard_ttl):
+    """
+    Cache a provider function's records in L1 (in-process LRU) and L2 (Redis).
+
+    The key is `prefix` plus the bound call arguments, so a sync function and
+    its async twin with the same signature share entries. The wrapped function
+    accepts `force_refresh=True` to bypass both tiers and refetch. L1 entries
+    are dropped when another process publishes a refresh of the same key.
+    Upstream calls share one circuit breaker per `prefix`.
+    """
+    def decorator(func):
+        build_key = _key_builder(prefix, func)
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, force_refresh=False, **kwargs):
+                ensure_invalidation_listener()
+                key = build_key(args, kwargs)
+                if not force_refresh:
+                    value = l1.get(key)
+                    if value is not None:
+                        _count(key, 'l1_hit')
+                        return value
+                value = await aget_or_refresh(
+                    key, lambda: func(*args, **kwargs), soft_ttl, hard_ttl,
+                    force_refresh=force_refresh, circuit=prefix
+                )
+                l1.set(key, value)
+                return value
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, force_refresh=False, **kwargs):
+                ensure_invalidation_listener()
+                key = build_key(args, kwargs)
+                if not force_refresh:
+                    value = l1.get(key)
+                    if value is not None:
+                        _count(key, 'l1_hit')
+                        return value
+                value = get_or_refresh(
+                    key, lambda: func(*args, **kwargs), soft_ttl, hard_ttl,
+                    force_refresh=force_refresh, circuit=prefix
+                )
+                l1.set(key, value)
+                return value
+
+        wrapper.cache_key = lambda *args, **kwargs: build_key(args, kwargs)
+        return wrapper
+
+    return decorator
@@ -0,0 +1,103 @@
+import logging
+
+from django.conf import settings
+
+from news_providers.redis_client import r, shared_async_client
+
+logger = logging.getLogger(__name__)
+
+# Circuit state lives in Redis so the bot, API and Celery processes trip and recover together.
+#   closed:    no `opened_until` field; calls go through, failures are counted per window
+#   open:      now < opened_until; calls are refused without touching the upstream API
+#   half-open: opened_until has passed; a single probe call (SET NX) decides what happens next
+
+# KEYS: state, probe; ARGV: probe timeout
+ALLOW_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local opened_until = tonumber(redis.call('HGET', KEYS[1], 'opened_until') or '0')
+if opened_until == 0 then
+    return 1
+end
+if now < opened_until then
+    return 0
+end
+if redis.call('SET', KEYS[2], '1', 'NX', 'EX', ARGV[1]) then
+    return 1
+end
+return 0
+"""
+
+# KEYS: state, probe; ARGV: failure threshold, base open seconds, max open seconds, failure window
+# Returns how long the circuit was opened for, or '0'.
+FAILURE_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local opened_until = tonumber(redis.call('HGET', KEYS[1], 'opened_until') or '0')
+if opened_until > 0 and now < opened_until then
+    return '0'
+end
+local failures = redis.call('HINCRBY', KEYS[1], 'failures', 1)
+redis.call('DEL', KEYS[2])
+if opened_until > 0 or failures >= tonumber(ARGV[1]) then
+    local trips = redis.call('HINCRBY', KEYS[1], 'trips', 1)
+    local duration = math.min(tonumber(ARGV[3]), tonumber(ARGV[2]) * 2 ^ (trips - 1))
+    redis.call('HSET', KEYS[1], 'opened_until', tostring(now + duration))
+    redis.call('EXPIRE', KEYS[1], math.ceil(duration) + tonumber(ARGV[3]))
+    return tostring(duration)
+end
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return '0'
+"""
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, provider):
+        super().__init__(f"{provider} is unavailable, circuit open")
+        self.provider = provider
+
+
+def _keys(provider):
+    return [f'circuit:{provider}', f'circuit:{provider}:probe']
+
+
+def _failure_args():
+    return [
+        settings.CIRCUIT_FAILURE_THRESHOLD,
+        settings.CIRCUIT_OPEN_SECONDS,
+        settings.CIRCUIT_MAX_OPEN_SECONDS,
+        settings.CIRCUIT_FAILURE_WINDOW,
+    ]
+
+
+def _log_trip(provider, opened_for, error):
+    opened_for = float(opened_for)
+    if opened_for:
+        logger.warning(f"Circuit for {provider} opened for {opened_for:.0f}s after: {error}")
+
+
+def allow(provider):
+    """True if a call to `provider` may go upstream now (closed, or the half-open probe)."""
+    return bool(r.eval(ALLOW_SCRIPT, 2, *_keys(provider), settings.CIRCUIT_PROBE_TIMEOUT))
+
+
+def record_success(provider):
+    r.delete(*_keys(provider))
+
+
+def record_failure(provider, error=None):
+    _log_trip(provider, r.eval(FAILURE_SCRIPT, 2, *_keys(provider), *_failure_args()), error)
+
+
+async def aallow(provider):
+    client = shared_async_client()
+    return bool(await client.eval(ALLOW_SCRIPT, 2, *_keys(provider), settings.CIRCUIT_PROBE_TIMEOUT))
+
+
+async def arecord_success(provider):
+    await shared_async_client().delete(*_keys(provider))
+
+
+async def arecord_failure(provider, error=None):
+    client = shared_async_client()
+    _log_trip(provider, await client.eval(FAILURE_SCRIPT, 2, *_keys(provider), *_failure_args()), error)
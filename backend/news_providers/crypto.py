@@ -1,46 +1,57 @@
+import logging
+
 import requests
 
 from smart_bot.settings import COINGECKO_TRENDING_URL
-from news_providers.redis_client import r
+from news_providers.cache import provider_cache
+from news_providers.http import async_http_client
+from news_providers.records import Coin
+from news_providers.rendering import render_markdown
+
+logger = logging.getLogger(__name__)
 
 CACHE_KEY = 'crypto_trending'
-CACHE_TTL = 3600 # 1 hour
-
-def get_crypto_trending():
-    
-    cached = r.get(CACHE_KEY)
-    if cached:
-        cached_str = cached.decode('utf-8')
-        print(f"Using cached data for {CACHE_KEY}")
-        return cached_str.split('\n\n')
-    
+CACHE_TTL = 3600 # 1 hour, hard expiry
+CACHE_SOFT_TTL = 300 # served as fresh for 5 minutes, then refreshed in the background
+
+def fetch_crypto_trending():
+    """Fetch trending coins from CoinGecko."""
+    response = requests.get(COINGECKO_TRENDING_URL, timeout=10)
+    response.raise_for_status()
+    return _parse_coins(response.json())
+
+async def afetch_crypto_trending():
+    """Async fetch_crypto_trending() over the shared keep-alive client."""
+    response = await async_http_client().get(COINGECKO_TRENDING_URL)
+    response.raise_for_status()
+    return _parse_coins(response.json())
+
+def _parse_coins(data):
+    return [
+        Coin(
+            name=item['item']['name'],
+            symbol=item['item']['symbol'],
+            market_cap_rank=item['item'].get('market_cap_rank'),
+            price_btc=item['item'].get('price_btc'),
+        )
+        for item in data.get('coins', [])
+    ]
+
+@provider_cache(CACHE_KEY, soft_ttl=CACHE_SOFT_TTL, hard_ttl=CACHE_TTL)
+def get_crypto_records():
+    """Trending coins as Coin records, served from the cache."""
+    return fetch_crypto_trending()
+
+@provider_cache(CACHE_KEY, soft_ttl=CACHE_SOFT_TTL, hard_ttl=CACHE_TTL)
+async def aget_crypto_records():
+    return await afetch_crypto_trending()
+
+async def aget_crypto_trending(force_refresh=False):
+    """Trending coins as Telegram Markdown blocks, or an error message, for the bot's event loop."""
     try:
-        response = requests.get(COINGECKO_TRENDING_URL, timeout=10)
-        data = response.json()
-
-        coins = data.get('coins', [])
-        results = []
-
-        for item in coins:
-            coin = item['item']
-            name = coin['name']
-            symbol = coin['symbol']
-            market_cap_rank = coin.get('market_cap_rank')
-            price_btc = coin.get('price_btc')
-            
-            results.append(
-                f"💰 *{name}* ({symbol.upper()})\n"
-                f"🔻 Ранг: {market_cap_rank}\n"
-                f"₿ Ціна в BTC: {price_btc:.8f}"
-            )
-        
-        r.set(CACHE_KEY, '\n\n'.join(results), ex=CACHE_TTL)
-        
-        print(f"New data fetched for {CACHE_KEY}")
-        return results
-    
+        return list(render_markdown(await aget_crypto_records(force_refresh=force_refresh)))
+
     except Exception as e:
         error_msg = f"Error fetching crypto trending: {e}"
-        print(error_msg)
-        return [error_msg]  # Return as list to match expected format
-            
\ No newline at end of file
+        logger.warning(error_msg, exc_info=True)
+        return [error_msg]
@@ -0,0 +1,28 @@
+import asyncio
+import weakref
+
+import httpx
+from django.conf import settings
+
+_loop_clients = weakref.WeakKeyDictionary()
+
+
+def async_http_client():
+    """Pooled keep-alive httpx client shared by provider calls on the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _loop_clients.get(loop)
+    if client is None:
+        client = _loop_clients[loop] = httpx.AsyncClient(
+            timeout=settings.PROVIDER_HTTP_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=settings.PROVIDER_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.PROVIDER_HTTP_MAX_KEEPALIVE,
+            ),
+        )
+    return client
+
+
+async def close_async_http_client():
+    client = _loop_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
@@ -1,70 +1,79 @@
+import logging
+
+import httpx
 import requests
 
 from django.conf import settings
-from news_providers.redis_client import r
+from news_providers.cache import provider_cache
+from news_providers.http import async_http_client
+from news_providers.records import Article
+from news_providers.rendering import render_markdown
+
+logger = logging.getLogger(__name__)
 
 CACHE_KEY = 'new_trending'
 CACHE_TTL = 1800
+CACHE_SOFT_TTL = 600
+
+NEWS_API_URL = 'https://newsapi.org/v2/top-headlines'
 
-def get_news_trending(category: str = 'business'):
+def _params(category):
+    return {
+        'apiKey': settings.NEW_API_KEY,
+        'country': "us",
+        'category': category,
+        'pageSize': 5
+    }
+
+def fetch_news_trending(category: str = 'business'):
     """
-    Get trending news from newsapi
+    Fetch top headlines from newsapi
     """
-    
-    cached = r.get(CACHE_KEY)
-    if cached:
-        print(f'Using cached data for {CACHE_KEY}')
-        return cached.decode('utf-8').split('\n\n')
-    
-    try:
-        api_key = settings.NEW_API_KEY
-        url = 'https://newsapi.org/v2/top-headlines'
+    response = requests.get(NEWS_API_URL, params=_params(category), timeout=10)
+    response.raise_for_status()
+    return _parse_articles(response.json())
 
-        params = {
-            'apiKey': api_key,
-            'country': "us",
-            'category': category,
-            'pageSize': 5
-        }
+async def afetch_news_trending(category: str = 'business'):
+    """Async fetch_news_trending() over the shared keep-alive client."""
+    response = await async_http_client().get(NEWS_API_URL, params=_params(category))
+    response.raise_for_status()
+    return _parse_articles(response.json())
 
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
+def _parse_articles(data):
+    return [
+        Article(
+            title=article.get('title') or 'No title',
+            source=(article.get('source') or {}).get('name') or 'Unknown',
+            url=article.get('url') or '',
+            description=article.get('description') or '',
+        )
+        for article in data.get('articles', [])
+    ]
 
-        data = response.json()
-        articles = data.get('articles', [])
+# Keyed by category, e.g. 'new_trending:category=business'
+@provider_cache(CACHE_KEY, soft_ttl=CACHE_SOFT_TTL, hard_ttl=CACHE_TTL)
+def get_news_records(category: str = 'business'):
+    """Top headlines as Article records, served from the cache."""
+    return fetch_news_trending(category)
 
+@provider_cache(CACHE_KEY, soft_ttl=CACHE_SOFT_TTL, hard_ttl=CACHE_TTL)
+async def aget_news_records(category: str = 'business'):
+    return await afetch_news_trending(category)
+
+async def aget_news_trending(category: str = 'business', force_refresh=False):
+    """Top headlines as Telegram Markdown blocks, or an error message, for the bot's event loop."""
+    try:
+        articles = await aget_news_records(category, force_refresh=force_refresh)
         if not articles:
             return ["No news available at the moment."]
+        return list(render_markdown(articles))
 
-        results = []
-        for article in articles:
-            title = article.get('title', 'No title')
-            source = article.get('source', {}).get('name', 'Unknown')
-            url = article.get('url', '')
-            description = article.get('description', '')
-            
-            if description and len(description) > 150:
-                description = description[:147] + '...'
-            
-            results.append(
-                f"📰 *{title}*\n"
-                f"🏢 Source: {source}\n"
-                f"📝 {description}\n"
-                f"🔗 {url}"
-            )
-        
-
-        r.set(CACHE_KEY, '\n\n'.join(results), ex=CACHE_TTL)
-        
-        print(f"New data fetched for {CACHE_KEY}")
-        return results
-    
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         error_msg = f"Error fetching news: {e}"
-        print(error_msg)
+        logger.warning(error_msg, exc_info=True)
         return [error_msg]
-        
+
     except Exception as e:
         error_msg = f"Unexpected error: {e}"
-        print(error_msg)
-        return [error_msg]
\ No newline at end of file
+        logger.warning(error_msg, exc_info=True)
+        return [error_msg]
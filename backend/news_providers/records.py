@@ -0,0 +1,50 @@
+from dataclasses import astuple, dataclass
+
+import msgpack
+
+
+@dataclass(frozen=True, slots=True)
+class Coin:
+    name: str
+    symbol: str
+    market_cap_rank: int | None = None
+    price_btc: float | None = None
+
+
+@dataclass(frozen=True, slots=True)
+class Quote:
+    symbol: str
+    name: str
+    price: float | None = None
+    previous_close: float | None = None
+
+    @property
+    def change_percent(self):
+        if self.price is None or not self.previous_close:
+            return None
+        return (self.price - self.previous_close) / self.previous_close * 100
+
+
+@dataclass(frozen=True, slots=True)
+class Article:
+    title: str
+    source: str
+    url: str
+    description: str = ''
+
+
+# Wire tags for the cache encoding; never reuse a number for a different type
+RECORD_TYPES = {1: Coin, 2: Quote, 3: Article}
+RECORD_TAGS = {cls: tag for tag, cls in RECORD_TYPES.items()}
+
+
+def pack(records, fetched_at):
+    """Encode records as msgpack: positional field arrays, no field names."""
+    rows = [[RECORD_TAGS[type(record)], *astuple(record)] for record in records]
+    return msgpack.packb([fetched_at, rows], use_bin_type=True)
+
+
+def unpack(payload):
+    """Decode a payload produced by pack(); returns (records tuple, fetched_at)."""
+    fetched_at, rows = msgpack.unpackb(payload, raw=False)
+    return tuple(RECORD_TYPES[row[0]](*row[1:]) for row in rows), fetched_at
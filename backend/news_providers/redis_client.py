@@ -1,4 +1,8 @@
+import asyncio
+import weakref
+
 import redis
+import redis.asyncio as aioredis
 from django.conf import settings
 
 redis_config = {
@@ -11,4 +15,27 @@ redis_config = {
 if settings.REDIS_PASSWORD:
     redis_config['password'] = settings.REDIS_PASSWORD
 
-r = redis.Redis(**redis_config)
\ No newline at end of file
+r = redis.Redis(**redis_config)
+
+
+def async_client():
+    """Create a redis.asyncio client bound to the running event loop."""
+    return aioredis.Redis(**redis_config)
+
+
+_loop_clients = weakref.WeakKeyDictionary()
+
+
+def shared_async_client():
+    """redis.asyncio client shared by every coroutine on the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _loop_clients.get(loop)
+    if client is None:
+        client = _loop_clients[loop] = aioredis.Redis(**redis_config)
+    return client
+
+
+async def close_shared_async_client():
+    client = _loop_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
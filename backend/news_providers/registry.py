@@ -0,0 +1,87 @@
+"""
+Providers ingested into topic feeds.
+
+Each Provider says how to read its records and which topic's feed item to
+store them as. Beat runs `topics.tasks.ingest_all_providers_task`, which fans
+out one `ingest_provider_task` per provider and parameter set.
+"""
+from dataclasses import dataclass
+from typing import Callable
+
+from django.conf import settings
+
+from news_providers import crypto, news, stocks
+from news_providers.rendering import render_markdown
+
+
+@dataclass(frozen=True, slots=True)
+class Provider:
+    name: str
+    topic: str
+    records: Callable  # provider_cache function returning a tuple of records
+    title: str  # may use the parameters, e.g. '{category}'
+    url: str
+    source: str
+    params: Callable = lambda: [{}]  # parameter sets to ingest, read when the fan-out runs
+    timeout: int | None = None  # soft time limit per run; INGEST_SOFT_TIME_LIMIT when None
+
+    @property
+    def soft_time_limit(self):
+        return self.timeout or settings.INGEST_SOFT_TIME_LIMIT
+
+    def feed_item_fields(self, records, params):
+        """FeedItem fields for one snapshot of `records`."""
+        return {
+            'title': self.title.format(**params),
+            'content': '\n\n'.join(render_markdown(records)),
+            'url': self.url,
+            'source': self.source,
+        }
+
+
+PROVIDERS = {}
+
+
+def register(provider):
+    PROVIDERS[provider.name] = provider
+    return provider
+
+
+def get_provider(name):
+    try:
+        return PROVIDERS[name]
+    except KeyError:
+        raise LookupError(f"Unknown provider: {name}") from None
+
+
+def ingestion_jobs():
+    """(provider, params) for every provider and parameter set to ingest."""
+    return [(provider, params) for provider in PROVIDERS.values() for params in provider.params()]
+
+
+register(Provider(
+    name='crypto',
+    topic='crypto',
+    records=crypto.get_crypto_records,
+    title='Crypto Trending Update',
+    url='https://coingecko.com/en',
+    source='coingecko',
+))
+register(Provider(
+    name='stocks',
+    topic='stocks',
+    records=stocks.get_stocks_records,
+    title='Stocks Trending Update',
+    url='https://finance.yahoo.com',
+    source='yfinance',
+    timeout=180,  # one batched download, with a per-ticker fallback when it fails
+))
+register(Provider(
+    name='news',
+    topic='news',
+    records=news.get_news_records,
+    title='Top {category} headlines',
+    url='https://newsapi.org',
+    source='newsapi',
+    params=lambda: [{'category': category} for category in settings.NEWS_INGEST_CATEGORIES],
+))
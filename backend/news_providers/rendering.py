@@ -0,0 +1,63 @@
+from dataclasses import asdict
+from functools import lru_cache, singledispatch
+
+from news_providers.records import Article, Coin, Quote
+
+
+@singledispatch
+def to_markdown(record):
+    raise TypeError(f"No Markdown renderer for {type(record).__name__}")
+
+
+@to_markdown.register
+def _(coin: Coin):
+    price_btc = f"{coin.price_btc:.8f}" if coin.price_btc is not None else 'N/A'
+    return (
+        f"💰 *{coin.name}* ({coin.symbol.upper()})\n"
+        f"🔻 Ранг: {coin.market_cap_rank}\n"
+        f"₿ Ціна в BTC: {price_btc}"
+    )
+
+
+@to_markdown.register
+def _(quote: Quote):
+    change_percent = quote.change_percent
+    if change_percent is None:
+        change_percent, emoji = 0, '❌'
+    else:
+        emoji = '📈' if change_percent > 0 else '📉'
+    return (
+        f"{emoji} *{quote.name}* ({quote.symbol})\n"
+        f"💵 Price: ${quote.price}\n"
+        f"📊 Change: {change_percent:+.2f}%"
+    )
+
+
+@to_markdown.register
+def _(article: Article):
+    description = article.description or ''
+    if len(description) > 150:
+        description = description[:147] + '...'
+    return (
+        f"📰 *{article.title}*\n"
+        f"🏢 Source: {article.source}\n"
+        f"📝 {description}\n"
+        f"🔗 {article.url}"
+    )
+
+
+# Records are frozen, so a snapshot renders once per format however often it's served
+
+@lru_cache(maxsize=128)
+def render_markdown(records):
+    """Telegram Markdown blocks, one per record."""
+    return tuple(to_markdown(record) for record in records)
+
+
+@lru_cache(maxsize=128)
+def render_json(records):
+    """JSON-ready dicts for the API, one per record."""
+    return tuple(
+        {'type': type(record).__name__.lower(), **asdict(record)}
+        for record in records
+    )
@@ -1,55 +1,183 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+
+import pandas as pd
 import yfinance as yf
+from django.conf import settings
+
+from news_providers import records
+from news_providers.cache import provider_cache
+from news_providers.records import Quote
+from news_providers.redis_client import r, shared_async_client
+from news_providers.rendering import render_markdown
 
-from news_providers.redis_client import r
+logger = logging.getLogger(__name__)
 
 CACHE_KEY = 'stocks_trending'
 CACHE_TTL = 3600
+CACHE_SOFT_TTL = 300
+
+QUOTE_CACHE_KEY = 'stocks:quote:{symbol}'
+NAMES_KEY = 'stocks:names'  # symbol -> company name, filled once per symbol by .info lookups
 
 
-def get_stocks_trending():
+def _closes(frame, symbol, single):
+    columns = frame if single else frame[symbol]
+    return columns['Close'].dropna()
 
+
+def _download_batch(symbols, names):
+    """One multi-ticker download for `symbols`; returns {symbol: Quote} for those with prices."""
+    frame = yf.download(
+        tickers=symbols,
+        period='5d',
+        interval='1d',
+        group_by='ticker',
+        threads=True,
+        progress=False,
+    )
+    single = not isinstance(frame.columns, pd.MultiIndex)
+    quotes = {}
+    for symbol in symbols:
+        try:
+            closes = _closes(frame, symbol, single)
+        except KeyError:
+            continue
+        if len(closes) < 2:
+            continue
+        quotes[symbol] = Quote(
+            symbol=symbol,
+            name=names.get(symbol, symbol),
+            price=round(float(closes.iloc[-1]), 2),
+            previous_close=round(float(closes.iloc[-2]), 2),
+        )
+    return quotes
+
+
+def _fetch_quote_info(symbol):
+    """Slow per-ticker scrape, used only for symbols the batch download missed."""
+    try:
+        info = yf.Ticker(symbol).info
+    except Exception as e:
+        logger.warning(f"Error fetching quote for {symbol}: {e}")
+        return None
+    return Quote(
+        symbol=symbol,
+        name=info.get("longName", symbol),
+        price=info.get('currentPrice'),
+        previous_close=info.get('previousClose'),
+    )
+
+
+def _fetch_name(symbol):
+    try:
+        return symbol, yf.Ticker(symbol).info.get('longName')
+    except Exception as e:
+        logger.warning(f"Error fetching the name of {symbol}: {e}")
+        return symbol, None
+
+
+def fetch_quotes(symbols=None):
     """
-    Get best performing stocks from yfinance
+    Fetch quotes for `symbols` (default: settings.STOCKS_TICKERS).
+
+    Symbols are downloaded in batches of STOCKS_BATCH_SIZE; anything a batch
+    misses falls back to per-ticker lookups on a bounded thread pool.
+    Company names are not in the download: up to STOCKS_NAME_LOOKUPS unknown
+    ones are looked up per call and kept in NAMES_KEY for good.
+    Every quote is cached under its own symbol key.
     """
-    
-    cached = r.get(CACHE_KEY)
-    if cached:
-        print(f'Using cached data for {CACHE_KEY}')
-        return cached.decode('utf-8').split('\n\n')
+    symbols = list(symbols or settings.STOCKS_TICKERS)
+    names = {key.decode(): value.decode() for key, value in r.hgetall(NAMES_KEY).items()}
+    quotes = {}
 
-    try:
-        tickers = [ "AAPL", "MSFT", "GOOGL", "META", "TSLA"]
-        results = []
-
-        for ticker_symbol in tickers:
-            ticker = yf.Ticker(ticker_symbol)
-            info = ticker.info
-
-            current_price = info.get('currentPrice')
-            previous_close = info.get('previousClose')
-
-            if previous_close and current_price != 'N/A':
-                change_percent = ((current_price - previous_close) / previous_close) * 100
-                emoji = '📈' if change_percent > 0 else '📉'
-            else:
-                change_percent = 0
-                emoji = '❌'
-            
-            
-            company_name = info.get("longName", ticker_symbol)
-
-        results.append(
-                f"{emoji} *{company_name}* ({ticker_symbol})\n"
-                f"💵 Price: ${current_price}\n"
-                f"📊 Change: {change_percent:+.2f}%"
+    batch_size = settings.STOCKS_BATCH_SIZE
+    for start in range(0, len(symbols), batch_size):
+        batch = symbols[start:start + batch_size]
+        started = time.monotonic()
+        try:
+            fetched = _download_batch(batch, names)
+        except Exception as e:
+            logger.warning(f"Batch download of {len(batch)} symbols failed: {e}")
+            fetched = {}
+        quotes.update(fetched)
+        logger.info(
+            f"Fetched {len(fetched)}/{len(batch)} stock quotes in {time.monotonic() - started:.2f}s"
         )
 
-        r.set(CACHE_KEY, '\n\n'.join(results), ex=CACHE_TTL)
+    missing = [symbol for symbol in symbols if symbol not in quotes]
+    if missing:
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=settings.STOCKS_FALLBACK_WORKERS) as pool:
+            fallback = [quote for quote in pool.map(_fetch_quote_info, missing) if quote is not None]
+        quotes.update((quote.symbol, quote) for quote in fallback)
+        if fallback:
+            r.hset(NAMES_KEY, mapping={quote.symbol: quote.name for quote in fallback})
+        logger.info(
+            f"Fetched {len(fallback)}/{len(missing)} stock quotes one by one in {time.monotonic() - started:.2f}s"
+        )
+
+    unnamed = [symbol for symbol, quote in quotes.items() if quote.name == symbol][:settings.STOCKS_NAME_LOOKUPS]
+    if unnamed:
+        with ThreadPoolExecutor(max_workers=settings.STOCKS_FALLBACK_WORKERS) as pool:
+            found = {symbol: name for symbol, name in pool.map(_fetch_name, unnamed) if name}
+        if found:
+            r.hset(NAMES_KEY, mapping=found)
+            quotes.update((symbol, replace(quotes[symbol], name=name)) for symbol, name in found.items())
+        logger.info(f"Looked up {len(found)}/{len(unnamed)} company names")
+
+    now = time.time()
+    with r.pipeline(transaction=False) as pipe:
+        for symbol, quote in quotes.items():
+            pipe.set(QUOTE_CACHE_KEY.format(symbol=symbol), records.pack((quote,), now), ex=CACHE_TTL)
+        pipe.execute()
+
+    return quotes
+
+
+def fetch_stocks_trending():
+    """
+    Fetch quotes for the tracked tickers and keep the best performers
+    """
+    quotes = fetch_quotes().values()
+    ranked = sorted(
+        quotes,
+        key=lambda quote: quote.change_percent if quote.change_percent is not None else float('-inf'),
+        reverse=True,
+    )
+    return ranked[:settings.STOCKS_TRENDING_LIMIT]
+
+
+async def aget_stock_quote(symbol):
+    """Last Quote cached for `symbol` by fetch_quotes(), or None."""
+    raw = await shared_async_client().get(QUOTE_CACHE_KEY.format(symbol=symbol.upper()))
+    if raw is None:
+        return None
+    quotes, _ = records.unpack(raw)
+    return quotes[0]
+
+
+@provider_cache(CACHE_KEY, soft_ttl=CACHE_SOFT_TTL, hard_ttl=CACHE_TTL)
+def get_stocks_records():
+    """Best performing tracked tickers as Quote records, served from the cache."""
+    return fetch_stocks_trending()
+
+
+@provider_cache(CACHE_KEY, soft_ttl=CACHE_SOFT_TTL, hard_ttl=CACHE_TTL)
+async def aget_stocks_records():
+    # yfinance has no async API; its blocking download runs in a worker thread
+    return await asyncio.to_thread(fetch_stocks_trending)
+
+
+async def aget_stocks_trending(force_refresh=False):
+    """Best performing stocks as Telegram Markdown blocks, or an error message, for the bot's event loop."""
+    try:
+        return list(render_markdown(await aget_stocks_records(force_refresh=force_refresh)))
 
-        print(f'New data fetched for {CACHE_KEY}')
-        return results
-           
     except Exception as e:
         error_msg = f"Error fetching stocks: {e}"
-        print(error_msg)
-        return [error_msg]
\ No newline at end of file
+        logger.warning(error_msg, exc_info=True)
+        return [error_msg]
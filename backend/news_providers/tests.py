@@ -0,0 +1,227 @@
+import threading
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from news_providers import cache, circuit, news
+from news_providers.records import Article
+from news_providers.redis_client import r
+
+
+@override_settings(CIRCUIT_FAILURE_THRESHOLD=2, CIRCUIT_OPEN_SECONDS=0.2, CIRCUIT_MAX_OPEN_SECONDS=1,
+                   CIRCUIT_FAILURE_WINDOW=60, CIRCUIT_PROBE_TIMEOUT=5)
+class CircuitBreakerTests(SimpleTestCase):
+    provider = 'test-provider'
+
+    def setUp(self):
+        r.delete(*circuit._keys(self.provider))
+        self.addCleanup(r.delete, *circuit._keys(self.provider))
+
+    def _open(self):
+        for _ in range(2):
+            circuit.record_failure(self.provider)
+
+    def test_opens_after_threshold_failures(self):
+        circuit.record_failure(self.provider)
+        self.assertTrue(circuit.allow(self.provider))
+        circuit.record_failure(self.provider)
+        self.assertFalse(circuit.allow(self.provider))
+
+    def test_half_open_lets_a_single_probe_through(self):
+        self._open()
+        time.sleep(0.25)
+        self.assertTrue(circuit.allow(self.provider))
+        self.assertFalse(circuit.allow(self.provider))
+
+    def test_successful_probe_closes_the_circuit(self):
+        self._open()
+        time.sleep(0.25)
+        self.assertTrue(circuit.allow(self.provider))
+        circuit.record_success(self.provider)
+        self.assertTrue(circuit.allow(self.provider))
+        self.assertTrue(circuit.allow(self.provider))
+
+    def test_failed_probe_reopens_for_longer(self):
+        self._open()
+        time.sleep(0.25)
+        self.assertTrue(circuit.allow(self.provider))
+        circuit.record_failure(self.provider)
+        # Second trip: 0.4s instead of 0.2s
+        time.sleep(0.25)
+        self.assertFalse(circuit.allow(self.provider))
+        time.sleep(0.2)
+        self.assertTrue(circuit.allow(self.provider))
+
+
+def _articles(title):
+    return (Article(title, 'test', 'https://example.com'),)
+
+
+class Fetcher:
+    """Counts upstream calls; returns `titles` in turn and raises an exception given instead of a title."""
+
+    def __init__(self, *titles, delay=0):
+        self.titles = list(titles)
+        self.delay = delay
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        title = self.titles.pop(0)
+        if isinstance(title, Exception):
+            raise title
+        return _articles(title)
+
+
+@override_settings(PROVIDER_LKG_TTL=600)
+class GetOrRefreshTests(SimpleTestCase):
+    key = 'test:get_or_refresh'
+
+    def setUp(self):
+        keys = (self.key, cache._lock_key(self.key), cache._lkg_key(self.key))
+        r.delete(*keys)
+        self.addCleanup(r.delete, *keys)
+
+    def _get(self, fetch, soft_ttl=60):
+        return cache.get_or_refresh(self.key, fetch, soft_ttl, 600)
+
+    def _hold_lock(self, seconds):
+        """Take the refresh lock as another caller would, giving it up after `seconds`."""
+        r.set(cache._lock_key(self.key), 'other', nx=True)
+        timer = threading.Timer(seconds, r.delete, [cache._lock_key(self.key)])
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+    def test_fresh_entry_is_served_from_the_cache(self):
+        fetch = Fetcher('first', 'second')
+        self.assertEqual(self._get(fetch), _articles('first'))
+        self.assertEqual(self._get(fetch), _articles('first'))
+        self.assertEqual(fetch.calls, 1)
+
+    def test_stale_entry_is_refreshed(self):
+        fetch = Fetcher('first', 'second')
+        self._get(fetch)
+        self.assertEqual(self._get(fetch, soft_ttl=0), _articles('second'))
+        self.assertEqual(fetch.calls, 2)
+
+    def test_stale_entry_is_served_while_another_caller_refreshes(self):
+        self._get(Fetcher('first'))
+        self._hold_lock(5)
+        fetch = Fetcher('second')
+        self.assertEqual(self._get(fetch, soft_ttl=0), _articles('first'))
+        self.assertEqual(fetch.calls, 0)
+
+    def test_only_the_lock_holder_refreshes_a_stale_entry(self):
+        self._get(Fetcher('first'))
+        fetch = Fetcher('second', delay=0.2)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self._get(fetch, soft_ttl=0))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(fetch.calls, 1)
+        self.assertEqual((results.count(_articles('first')), results.count(_articles('second'))), (4, 1))
+        self.assertIsNone(r.get(cache._lock_key(self.key)))
+
+    def test_cold_miss_waits_for_the_lock_holder(self):
+        self._hold_lock(5)
+        threading.Timer(0.2, cache._store, [self.key, _articles('stored'), 600]).start()
+        fetch = Fetcher('own')
+        self.assertEqual(self._get(fetch), _articles('stored'))
+        self.assertEqual(fetch.calls, 0)
+
+    def test_cold_miss_takes_over_when_the_lock_holder_gives_up(self):
+        self._hold_lock(0.2)
+        fetch = Fetcher('own')
+        self.assertEqual(self._get(fetch), _articles('own'))
+        self.assertEqual(fetch.calls, 1)
+
+    def test_last_known_good_is_served_when_the_entry_is_gone_and_refresh_fails(self):
+        self._get(Fetcher('first'))
+        r.delete(self.key)
+        self.assertEqual(self._get(Fetcher(ConnectionError('upstream down'))), _articles('first'))
+
+    def test_failed_refresh_of_a_stale_entry_serves_it(self):
+        self._get(Fetcher('first'))
+        self.assertEqual(self._get(Fetcher(ConnectionError('upstream down')), soft_ttl=0), _articles('first'))
+
+    def test_failure_without_last_known_good_is_raised(self):
+        with self.assertRaises(ConnectionError):
+            self._get(Fetcher(ConnectionError('upstream down')))
+
+    def test_cold_miss_wait_times_out(self):
+        self._hold_lock(5)
+        with mock.patch.object(cache, 'WAIT_TIMEOUT', 0.3), self.assertRaises(TimeoutError):
+            self._get(Fetcher('own'))
+
+
+PREFIX = 'test:provider_cache'
+
+
+@override_settings(PROVIDER_LKG_TTL=600)
+class ProviderCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.calls = []
+
+        @cache.provider_cache(PREFIX, soft_ttl=60, hard_ttl=600)
+        def get_records(category='business'):
+            self.calls.append(category)
+            return _articles(category)
+
+        self.get_records = get_records
+        self.addCleanup(self._forget, 'business', 'sports')
+        self.addCleanup(r.delete, *circuit._keys(PREFIX))
+
+    def _forget(self, *categories):
+        for category in categories:
+            key = self.get_records.cache_key(category)
+            cache.l1.invalidate(key)
+            r.delete(key, cache._lkg_key(key))
+
+    def test_key_includes_the_bound_arguments(self):
+        self.assertEqual(news.get_news_records.cache_key(), 'new_trending:category=business')
+        self.assertEqual(news.get_news_records.cache_key('sports'), 'new_trending:category=sports')
+        self.assertEqual(news.get_news_records.cache_key(category='sports'), 'new_trending:category=sports')
+        # The async twin shares the entries
+        self.assertEqual(news.aget_news_records.cache_key('sports'), 'new_trending:category=sports')
+
+    def test_key_without_arguments_is_the_prefix(self):
+        get_all = cache.provider_cache(PREFIX, soft_ttl=60, hard_ttl=600)(lambda: ())
+        self.assertEqual(get_all.cache_key(), PREFIX)
+
+    def test_arguments_are_cached_separately(self):
+        self.assertEqual(self.get_records(), _articles('business'))
+        self.assertEqual(self.get_records('sports'), _articles('sports'))
+        self.assertEqual(self.get_records(category='sports'), _articles('sports'))
+        self.assertEqual(self.calls, ['business', 'sports'])
+
+    def test_l1_hit_skips_redis(self):
+        self.get_records()
+        r.delete(self.get_records.cache_key())
+        self.assertEqual(self.get_records(), _articles('business'))
+        self.assertEqual(self.calls, ['business'])
+
+    def test_force_refresh_bypasses_both_tiers(self):
+        self.get_records()
+        self.get_records(force_refresh=True)
+        self.assertEqual(self.calls, ['business', 'business'])
+
+    def test_listener_invalidates_keys_published_by_other_processes(self):
+        cache.ensure_invalidation_listener()
+        own_key, other_key = self.get_records.cache_key('business'), self.get_records.cache_key('sports')
+        # Retry until the listener is subscribed and past its initial clear of the caches
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            cache.l1.set(own_key, _articles('business'))
+            cache.l1.set(other_key, _articles('sports'))
+            r.publish(cache.INVALIDATION_CHANNEL, cache._invalidation_message(own_key))
+            r.publish(cache.INVALIDATION_CHANNEL, f'other-instance {other_key}')
+            time.sleep(0.05)
+            # Messages are handled in order: once the second one is, so is the first
+            if cache.l1.get(other_key) is None and cache.l1.get(own_key) is not None:
+                break
+        self.assertIsNone(cache.l1.get(other_key))
+        self.assertEqual(cache.l1.get(own_key), _articles('business'))
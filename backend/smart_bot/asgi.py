@@ -2,6 +2,8 @@
 ASGI config for smart_bot project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+With BOT_MODE=webhook, requests to BOT_WEBHOOK_PATH go to the Telegram webhook
+and everything else to Django.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +15,19 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'smart_bot.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+
+if settings.BOT_MODE == 'webhook':
+    from bot.webhook import TelegramWebhook  # noqa: E402
+
+    telegram_webhook = TelegramWebhook()
+
+    async def application(scope, receive, send):
+        if scope['type'] == 'lifespan' or scope.get('path') == settings.BOT_WEBHOOK_PATH:
+            await telegram_webhook(scope, receive, send)
+        else:
+            await django_application(scope, receive, send)
+else:
+    application = django_application
@@ -1,9 +1,83 @@
 from __future__ import absolute_import, unicode_literals
+import logging
 import os
+import time
+from datetime import datetime
 from celery import Celery
+from celery.signals import beat_init, before_task_publish, task_postrun, task_prerun, worker_process_shutdown, worker_ready
+from prometheus_client import multiprocess, start_http_server
+
+from smart_bot.metrics import CELERY_QUEUE_WAIT_SECONDS, CELERY_TASK_SECONDS, collector_registry
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'smart_bot.settings')
 
+logger = logging.getLogger(__name__)
+
 app = Celery('smart_bot')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
+
+
+_task_started = {}
+
+@before_task_publish.connect
+def stamp_sent_at(headers=None, **kwargs):
+    """Record when a task was queued; workers turn it into celery_queue_wait_seconds."""
+    if headers is not None:
+        headers.setdefault('sent_at', time.time())
+
+def _queue_wait(request):
+    sent_at = request.get('sent_at')
+    if sent_at is None:
+        return None
+    # A countdown or eta task is only due from its eta
+    eta = request.eta
+    if eta:
+        eta = datetime.fromisoformat(eta) if isinstance(eta, str) else eta
+        sent_at = max(sent_at, eta.timestamp())
+    return max(time.time() - sent_at, 0)
+
+@task_prerun.connect
+def start_task_timer(task_id=None, task=None, **kwargs):
+    _task_started[task_id] = time.monotonic()
+    wait = _queue_wait(task.request)
+    if wait is not None:
+        queue = (task.request.delivery_info or {}).get('routing_key') or 'unknown'
+        CELERY_QUEUE_WAIT_SECONDS.labels(queue).observe(wait)
+
+@task_postrun.connect
+def observe_task_duration(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        CELERY_TASK_SECONDS.labels(task.name, state or 'UNKNOWN').observe(time.monotonic() - started)
+
+@task_postrun.connect
+def observe_task_pool_stats(**kwargs):
+    # Pool worker processes own the connection pools; the metrics server only sees their samples
+    from smart_bot.dbpool import observe_pool_stats
+    observe_pool_stats()
+
+@beat_init.connect
+def remove_retired_beat_entries(**kwargs):
+    """Delete RETIRED_BEAT_ENTRIES from the database schedule; deleting makes beat reload it."""
+    from django.conf import settings
+    from django_celery_beat.models import PeriodicTask
+    try:
+        deleted, _ = PeriodicTask.objects.filter(name__in=settings.RETIRED_BEAT_ENTRIES).delete()
+    except Exception as e:
+        logger.warning(f"Could not remove retired beat entries: {e}")
+        return
+    if deleted:
+        logger.info(f"Removed retired beat entries: {', '.join(settings.RETIRED_BEAT_ENTRIES)}")
+
+@worker_ready.connect
+def start_metrics_server(**kwargs):
+    """Expose the worker's metrics (aggregated over its pool processes) on WORKER_METRICS_PORT."""
+    from django.conf import settings
+    if settings.WORKER_METRICS_PORT:
+        start_http_server(settings.WORKER_METRICS_PORT, registry=collector_registry())
+
+@worker_process_shutdown.connect
+def mark_metrics_process_dead(pid=None, **kwargs):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid or os.getpid())
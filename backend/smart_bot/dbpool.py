@@ -0,0 +1,60 @@
+from django.core.signals import request_finished
+from django.db import connections
+
+from smart_bot.metrics import DB_POOL_CONNECTIONS, DB_POOL_ERRORS, DB_POOL_REQUESTS, DB_POOL_WAIT_SECONDS
+
+
+def pool_stats():
+    """
+    Connection pool figures for this process, per database alias.
+
+    Counters are cumulative since the pool opened. `acquire_wait_ms_avg` is the
+    mean time a request waited for a connection; a growing `waiting` count or
+    wait time means the pool is smaller than the concurrency it serves.
+    Aliases without a pool are left out.
+    """
+    stats = {}
+    for connection in connections.all():
+        if not connection.settings_dict['OPTIONS'].get('pool'):
+            continue
+        pool = connection.pool
+        raw = pool.get_stats()
+        requests = raw.get('requests_num', 0)
+        # Django opens the pool on first use; until then it holds no connections
+        size = 0 if pool.closed else raw.get('pool_size', 0)
+        available = 0 if pool.closed else raw.get('pool_available', 0)
+        stats[connection.alias] = {
+            'min_size': raw.get('pool_min', 0),
+            'max_size': raw.get('pool_max', 0),
+            'size': size,
+            'in_use': size - available,
+            'available': available,
+            'waiting': raw.get('requests_waiting', 0),
+            'requests': requests,
+            'queued_requests': raw.get('requests_queued', 0),
+            'acquire_wait_ms': raw.get('requests_wait_ms', 0),
+            'acquire_wait_ms_avg': round(raw.get('requests_wait_ms', 0) / requests, 2) if requests else 0.0,
+            'acquire_errors': raw.get('requests_errors', 0),
+            'connections_opened': raw.get('connections_num', 0),
+            'connection_errors': raw.get('connections_errors', 0),
+        }
+    return stats
+
+
+def observe_pool_stats():
+    """Copy this process's pool_stats() into the db_pool_* gauges."""
+    for alias, stats in pool_stats().items():
+        for state in ('size', 'in_use', 'available', 'waiting'):
+            DB_POOL_CONNECTIONS.labels(alias, state).set(stats[state])
+        DB_POOL_REQUESTS.labels(alias).set(stats['requests'])
+        DB_POOL_WAIT_SECONDS.labels(alias).set(stats['acquire_wait_ms'] / 1000)
+        DB_POOL_ERRORS.labels(alias, 'acquire').set(stats['acquire_errors'])
+        DB_POOL_ERRORS.labels(alias, 'connection').set(stats['connection_errors'])
+
+
+def _observe_after_request(**kwargs):
+    observe_pool_stats()
+
+
+# Runs after Django's own request_finished handler has returned the connection to the pool
+request_finished.connect(_observe_after_request, dispatch_uid='dbpool_observe_after_request')
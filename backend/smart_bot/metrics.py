@@ -0,0 +1,120 @@
+"""
+Prometheus metrics shared by the API, the bot and the Celery workers.
+
+When PROMETHEUS_MULTIPROC_DIR is set (several uvicorn or Celery worker
+processes), every process writes its samples there and the exposed registry
+aggregates them. The directory must be empty when the service starts.
+"""
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+import redis
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+PROVIDER_FETCH_SECONDS = Histogram(
+    'provider_fetch_seconds', 'Latency of upstream provider API fetches', ['provider', 'outcome'],
+)
+PROVIDER_CACHE_REQUESTS = Counter(
+    'provider_cache_requests_total',
+    'Provider cache lookups by result: l1_hit, hit, stale, miss, refresh or last_known_good',
+    ['cache_key', 'result'],
+)
+TELEGRAM_MESSAGES = Counter(
+    'telegram_messages_total',
+    'Broadcast messages by outcome: sent, failed, retried or rate_limited (HTTP 429)',
+    ['outcome'],
+)
+INGEST_RUN_SECONDS = Histogram(
+    'ingest_run_seconds', 'Duration of one provider ingestion run, by outcome: inserted, unchanged, empty or error',
+    ['provider', 'outcome'],
+)
+BOT_HANDLER_SECONDS = Histogram(
+    'bot_handler_seconds', 'Bot command handler latency', ['command'],
+)
+CELERY_TASK_SECONDS = Histogram(
+    'celery_task_seconds', 'Celery task run time', ['task', 'state'],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, float('inf')),
+)
+# Summed over the live processes of a multiprocess service; the counts are cumulative per process
+DB_POOL_CONNECTIONS = Gauge(
+    'db_pool_connections', 'Pooled database connections by state: size, in_use, available or waiting (requests)',
+    ['alias', 'state'], multiprocess_mode='livesum',
+)
+DB_POOL_REQUESTS = Gauge(
+    'db_pool_requests', 'Connections requested from the pool since it opened', ['alias'],
+    multiprocess_mode='livesum',
+)
+DB_POOL_WAIT_SECONDS = Gauge(
+    'db_pool_wait_seconds', 'Time spent waiting for a pooled connection since the pool opened', ['alias'],
+    multiprocess_mode='livesum',
+)
+DB_POOL_ERRORS = Gauge(
+    'db_pool_errors', 'Pool errors since it opened, by kind: acquire (timeout) or connection', ['alias', 'kind'],
+    multiprocess_mode='livesum',
+)
+CELERY_QUEUE_WAIT_SECONDS = Histogram(
+    'celery_queue_wait_seconds', 'Time Celery tasks spent queued before a worker started them', ['queue'],
+    buckets=(0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, float('inf')),
+)
+
+
+class CeleryQueueCollector:
+    """celery_queue_length gauge, read from the Redis broker at scrape time."""
+
+    def __init__(self):
+        self._client = None
+
+    def collect(self):
+        from django.conf import settings
+        queues = [queue.name for queue in settings.CELERY_TASK_QUEUES]
+        try:
+            if self._client is None:
+                self._client = redis.Redis.from_url(settings.CELERY_BROKER_URL, socket_timeout=1)
+            with self._client.pipeline(transaction=False) as pipe:
+                for queue in queues:
+                    pipe.llen(queue)
+                lengths = pipe.execute()
+        except Exception as e:
+            logger.warning(f"Could not read Celery queue lengths: {e}")
+            return
+
+        gauge = GaugeMetricFamily('celery_queue_length', 'Messages waiting in each Celery queue', labels=['queue'])
+        for queue, length in zip(queues, lengths):
+            gauge.add_metric([queue], length)
+        yield gauge
+
+
+# Queue lengths are the same for every process, so only the API exposes them
+QUEUE_REGISTRY = CollectorRegistry(auto_describe=False)
+QUEUE_REGISTRY.register(CeleryQueueCollector())
+
+
+def collector_registry():
+    """Registry to expose: the multiprocess aggregate when enabled, else this process's own."""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def metric_key(cache_key):
+    """Label for a provider cache key: its prefix, without the per-argument suffix."""
+    return cache_key.split(':', 1)[0]
+
+
+@contextmanager
+def observe_fetch(provider):
+    """Time an upstream fetch into PROVIDER_FETCH_SECONDS, labelled by outcome."""
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'success'
+    finally:
+        PROVIDER_FETCH_SECONDS.labels(provider, outcome).observe(time.perf_counter() - started)
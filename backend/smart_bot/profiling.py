@@ -0,0 +1,173 @@
+"""
+Opt-in request profiling for the API.
+
+A request is profiled when a staff user sends `X-Profile: 1` (or `X-Profile:
+cprofile` for a cProfile sample as well), or when it falls in the
+REQUEST_PROFILING_SAMPLE_RATE share of traffic. Profiled requests record SQL
+query count and time, serializer time and total time. Staff get them back in a
+Server-Timing header, and the slowest profiles are kept in Redis for the
+staff-only slow request view.
+"""
+import cProfile
+import io
+import json
+import logging
+import pstats
+import random
+import time
+import uuid
+from contextlib import ExitStack
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+
+from django.conf import settings
+from django.db import connections
+
+from news_providers.redis_client import r
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+SLOW_REQUESTS_KEY = 'profiling:slow_requests'
+CPROFILE_LINES = 30
+
+_current = ContextVar('request_profile', default=None)
+
+
+@dataclass
+class RequestProfile:
+    method: str
+    path: str
+    started_at: float = field(default_factory=time.time)
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: int = 0
+    user: str = ''
+    total_ms: float = 0.0
+    queries: int = 0
+    db_ms: float = 0.0
+    serializer_ms: float = 0.0
+    cprofile: str = ''
+    _serializer_depth: int = field(default=0, repr=False)
+
+    def server_timing(self):
+        return (
+            f'db;dur={self.db_ms:.1f};desc="{self.queries} queries", '
+            f'serializer;dur={self.serializer_ms:.1f}, '
+            f'total;dur={self.total_ms:.1f}'
+        )
+
+    def as_dict(self):
+        data = asdict(self)
+        data.pop('_serializer_depth')
+        return data
+
+
+class _QueryTimer:
+    """execute_wrapper that adds every query's duration to the current profile."""
+
+    def __init__(self, profile):
+        self.profile = profile
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.profile.queries += 1
+            self.profile.db_ms += (time.perf_counter() - started) * 1000
+
+
+class ProfiledSerializerMixin:
+    """
+    Add a serializer's to_representation() time to the current request profile.
+
+    Nested serializers are counted once, by the outermost one. The time includes
+    queries run lazily while serializing, which is where N+1 patterns show up.
+    """
+
+    def to_representation(self, instance):
+        profile = _current.get()
+        if profile is None:
+            return super().to_representation(instance)
+
+        profile._serializer_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            profile._serializer_depth -= 1
+            if not profile._serializer_depth:
+                profile.serializer_ms += (time.perf_counter() - started) * 1000
+
+
+def _is_staff(request):
+    user = getattr(request, 'user', None)
+    return bool(user and user.is_authenticated and user.is_staff)
+
+
+def record_slow_request(profile):
+    """Keep the REQUEST_PROFILING_KEEP slowest profiles, across every API process."""
+    try:
+        with r.pipeline(transaction=False) as pipe:
+            pipe.zadd(SLOW_REQUESTS_KEY, {json.dumps(profile.as_dict()): profile.total_ms})
+            pipe.zremrangebyrank(SLOW_REQUESTS_KEY, 0, -settings.REQUEST_PROFILING_KEEP - 1)
+            pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not record request profile for {profile.path}: {e}")
+
+
+def slow_requests():
+    """Recorded profiles, slowest first."""
+    return [json.loads(entry) for entry in r.zrevrange(SLOW_REQUESTS_KEY, 0, -1)]
+
+
+def clear_slow_requests():
+    r.delete(SLOW_REQUESTS_KEY)
+
+
+class RequestProfilingMiddleware:
+    """Profile opted-in requests; see the module docstring."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        requested = request.META.get(PROFILE_HEADER, '').lower()
+        sampled = random.random() < settings.REQUEST_PROFILING_SAMPLE_RATE
+        if not requested and not sampled:
+            return self.get_response(request)
+
+        profile = RequestProfile(request.method, request.path)
+        profiler = cProfile.Profile() if requested == 'cprofile' and _is_staff(request) else None
+        token = _current.set(profile)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(_QueryTimer(profile)))
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+        finally:
+            _current.reset(token)
+        profile.total_ms = (time.perf_counter() - started) * 1000
+
+        # DRF authenticates inside the view and passes the user back to the request
+        staff = _is_staff(request)
+        profile.status = response.status_code
+        profile.user = request.user.get_username() if staff else ''
+        if profiler is not None:
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(CPROFILE_LINES)
+            profile.cprofile = stream.getvalue()
+
+        if requested and staff:
+            response['Server-Timing'] = profile.server_timing()
+            response['X-Request-Profile'] = profile.id
+        if sampled or (requested and staff):
+            record_slow_request(profile)
+        return response
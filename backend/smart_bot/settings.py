@@ -15,6 +15,7 @@ import os
 from dotenv import load_dotenv
 
 from celery.schedules import crontab
+from kombu import Queue
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -58,6 +59,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'smart_bot.profiling.RequestProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -85,6 +87,14 @@ WSGI_APPLICATION = 'smart_bot.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Connections come from a psycopg 3 pool, one per process. Size it per process type:
+# the bot's BOT_DB_THREADS, the web server's threads, one or two per Celery worker process.
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', 2))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))  # seconds to wait for a free connection
+DB_POOL_MAX_IDLE = float(os.getenv('DB_POOL_MAX_IDLE', 300))  # idle connections above min_size are closed after this
+DB_POOL_MAX_LIFETIME = float(os.getenv('DB_POOL_MAX_LIFETIME', 1800))
+
 DATABASES = {
     'default' : {
         'ENGINE' : 'django.db.backends.postgresql',
@@ -93,6 +103,21 @@ DATABASES = {
         'PASSWORD' : 'password',
         'HOST' : 'db',
         'PORT' : '5432',
+        # Pooled connections are handed back on close, so they must not be persistent
+        'CONN_MAX_AGE' : 0,
+        # With a pool, Django turns this into psycopg_pool's check=ConnectionPool.check_connection,
+        # which tests a connection as it leaves the pool (a 'check' key in OPTIONS['pool'] would
+        # clash with it). Django's own per-request health check is skipped for pooled connections.
+        'CONN_HEALTH_CHECKS' : True,
+        'OPTIONS' : {
+            'pool' : {
+                'min_size' : DB_POOL_MIN_SIZE,
+                'max_size' : DB_POOL_MAX_SIZE,
+                'timeout' : DB_POOL_TIMEOUT,
+                'max_idle' : DB_POOL_MAX_IDLE,
+                'max_lifetime' : DB_POOL_MAX_LIFETIME,
+            },
+        },
     }
 }
 
@@ -123,16 +148,110 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Europe/Kiev'
 
+# Ingestion, broadcasts and maintenance each get their own queue (and, in docker-compose,
+# their own worker) so a long broadcast never delays fetching fresh data
+CELERY_TASK_QUEUES = (Queue('ingest'), Queue('broadcast'), Queue('maintenance'))
+CELERY_TASK_DEFAULT_QUEUE = 'maintenance'
+CELERY_TASK_ROUTES = {
+    'topics.tasks.ingest_provider_task': {'queue': 'ingest'},
+    'topics.tasks.ingest_all_providers_task': {'queue': 'ingest'},
+    'topics.tasks.refresh_provider_caches_task': {'queue': 'ingest'},
+    'topics.tasks.send_topic_updates_task': {'queue': 'broadcast'},
+    'topics.tasks.send_slot_updates_task': {'queue': 'broadcast'},
+    'topics.tasks.push_topic_update_task': {'queue': 'broadcast'},
+    'topics.tasks.send_topic_updates_sharded_task': {'queue': 'broadcast'},
+    'topics.tasks.send_topic_updates_shard_task': {'queue': 'broadcast'},
+    'topics.tasks.aggregate_broadcast_results': {'queue': 'broadcast'},
+    'topics.tasks.prune_feed_items_task': {'queue': 'maintenance'},
+}
+# Reserve one message per process at a time; long tasks would otherwise hold back queued ones
+CELERY_WORKER_PREFETCH_MULTIPLIER = int(os.getenv('CELERY_WORKER_PREFETCH_MULTIPLIER', 1))
+
+# Soft time limits in seconds; the hard limit follows TASK_TIME_LIMIT_GRACE seconds later
+INGEST_SOFT_TIME_LIMIT = int(os.getenv('INGEST_SOFT_TIME_LIMIT', 120))
+BROADCAST_SOFT_TIME_LIMIT = int(os.getenv('BROADCAST_SOFT_TIME_LIMIT', 50 * 60))
+MAINTENANCE_SOFT_TIME_LIMIT = int(os.getenv('MAINTENANCE_SOFT_TIME_LIMIT', 30 * 60))
+TASK_TIME_LIMIT_GRACE = int(os.getenv('TASK_TIME_LIMIT_GRACE', 60))
+# acks_late tasks are redelivered when unacknowledged this long, so it must outlast every hard limit
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'visibility_timeout': max(
+        INGEST_SOFT_TIME_LIMIT, BROADCAST_SOFT_TIME_LIMIT, MAINTENANCE_SOFT_TIME_LIMIT
+    ) + TASK_TIME_LIMIT_GRACE + 600,
+}
+
+# Broadcast Settings
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', 20))
+BROADCAST_GLOBAL_RATE = float(os.getenv('BROADCAST_GLOBAL_RATE', 30))  # messages per second, all chats
+BROADCAST_PER_CHAT_RATE = float(os.getenv('BROADCAST_PER_CHAT_RATE', 1))  # messages per second, one chat
+BROADCAST_MAX_RETRIES = int(os.getenv('BROADCAST_MAX_RETRIES', 3))
+
+# Sharded mode fans the broadcast out to several workers sharing one Redis rate limiter
+BROADCAST_SHARDED = os.getenv('BROADCAST_SHARDED', 'False').lower() in ('true', '1', 'yes')
+BROADCAST_SHARD_SIZE = int(os.getenv('BROADCAST_SHARD_SIZE', 5000))  # subscriptions per shard
+BROADCAST_SHARD_PARALLELISM = int(os.getenv('BROADCAST_SHARD_PARALLELISM', 8))  # max shards per broadcast
+
+# Slotted mode delivers every minute to the users whose hashed (or preferred) minute it is,
+# instead of messaging every subscriber at the top of the hour
+BROADCAST_SLOTTED = os.getenv('BROADCAST_SLOTTED', 'True').lower() in ('true', '1', 'yes')
+
+# Push a topic's new items to its subscribers as soon as they are ingested, collapsing
+# inserts that arrive within TOPIC_PUSH_DEBOUNCE seconds into one push. A push reaches every
+# subscriber of the topic at once, so it is opt-in while slotted delivery is on
+TOPIC_PUSH_ENABLED = os.getenv('TOPIC_PUSH_ENABLED', str(not BROADCAST_SLOTTED)).lower() in ('true', '1', 'yes')
+TOPIC_PUSH_DEBOUNCE = int(os.getenv('TOPIC_PUSH_DEBOUNCE', 30))
+
+# Feed API Settings
+FEED_PAGE_SIZE = int(os.getenv('FEED_PAGE_SIZE', 50))
+FEED_MAX_PAGE_SIZE = int(os.getenv('FEED_MAX_PAGE_SIZE', 200))
+
+# Feed Retention Settings
+FEED_RETENTION_DAYS = int(os.getenv('FEED_RETENTION_DAYS', 90))  # default for topics without their own; 0 keeps forever
+FEED_PRUNE_BATCH_SIZE = int(os.getenv('FEED_PRUNE_BATCH_SIZE', 1000))
+FEED_PRUNE_BATCH_PAUSE = float(os.getenv('FEED_PRUNE_BATCH_PAUSE', 0.1))  # seconds between delete batches
+
+# Provider ingestion: every registered provider is stored as feed items this often (seconds)
+INGEST_INTERVAL = int(os.getenv('INGEST_INTERVAL', 60 * 30))
+# NewsAPI categories ingested into the news topic, one run each
+NEWS_INGEST_CATEGORIES = [
+    category.strip()
+    for category in os.getenv('NEWS_INGEST_CATEGORIES', 'business').split(',')
+    if category.strip()
+]
+
 CELERY_BEAT_SCHEDULE = {
-    'fetch-crypto-every-30-minutes': {
-        'task': 'topics.tasks.fetch_crypto_news_task',
-        'schedule': 60 * 30,  # every 30 minutes (1800 seconds)
+    'ingest-providers': {
+        'task': 'topics.tasks.ingest_all_providers_task',
+        'schedule': INGEST_INTERVAL,
+    },
+    'refresh-provider-caches-every-4-minutes': {
+        'task': 'topics.tasks.refresh_provider_caches_task',
+        'schedule': 60 * 4,  # shorter than the providers' 5 minute soft TTL
+    },
+    'prune-feed-items-daily': {
+        'task': 'topics.tasks.prune_feed_items_task',
+        'schedule': crontab(hour=3, minute=0),  # every day at 03:00
     },
-    'send-updates-every-hour': {
-        'task': 'topics.tasks.send_topic_updates_task',
+}
+
+if BROADCAST_SLOTTED:
+    CELERY_BEAT_SCHEDULE['send-slot-updates-every-minute'] = {
+        'task': 'topics.tasks.send_slot_updates_task',
+        'schedule': crontab(),  # every minute; each user is due once an hour
+    }
+else:
+    CELERY_BEAT_SCHEDULE['send-updates-every-hour'] = {
+        'task': (
+            'topics.tasks.send_topic_updates_sharded_task' if BROADCAST_SHARDED
+            else 'topics.tasks.send_topic_updates_task'
+        ),
         'schedule': 60 * 60,  # every hour (3600 seconds)
     }
-}
+
+# DatabaseScheduler only adds and updates rows, so beat deletes entries the schedule no
+# longer has on startup; otherwise switching BROADCAST_SLOTTED would leave both running
+RETIRED_BEAT_ENTRIES = [
+    'send-updates-every-hour' if BROADCAST_SLOTTED else 'send-slot-updates-every-minute',
+]
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
@@ -159,6 +278,63 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Telegram Bot Settings
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 COINGECKO_TRENDING_URL = os.getenv('COINGECKO_TRENDING_URL', 'https://api.coingecko.com/api/v3/search/trending')
+NEW_API_KEY = os.getenv('NEW_API_KEY')
+
+# Stocks provider: tracked tickers are fetched in multi-ticker batches
+STOCKS_TICKERS = [
+    symbol.strip().upper()
+    for symbol in os.getenv('STOCKS_TICKERS', 'AAPL,MSFT,GOOGL,META,TSLA').split(',')
+    if symbol.strip()
+]
+STOCKS_BATCH_SIZE = int(os.getenv('STOCKS_BATCH_SIZE', 100))
+STOCKS_FALLBACK_WORKERS = int(os.getenv('STOCKS_FALLBACK_WORKERS', 8))  # threads for per-ticker lookups
+STOCKS_NAME_LOOKUPS = int(os.getenv('STOCKS_NAME_LOOKUPS', 20))  # unknown company names looked up per fetch
+STOCKS_TRENDING_LIMIT = int(os.getenv('STOCKS_TRENDING_LIMIT', 5))  # best performers shown by /stocks
+
+# In-process (L1) provider cache in front of Redis; cleared across processes via pub/sub
+PROVIDER_L1_MAXSIZE = int(os.getenv('PROVIDER_L1_MAXSIZE', 256))
+PROVIDER_L1_TTL = float(os.getenv('PROVIDER_L1_TTL', 30))
+
+PROVIDER_LKG_TTL = int(os.getenv('PROVIDER_LKG_TTL', 60 * 60 * 24 * 7))  # last known good payloads, 1 week
+
+# Bot-side resolution cache: telegram_id -> user pk and the topic name -> id table
+BOT_USER_CACHE_SIZE = int(os.getenv('BOT_USER_CACHE_SIZE', 10000))
+BOT_USER_CACHE_TTL = float(os.getenv('BOT_USER_CACHE_TTL', 600))
+BOT_TOPIC_CACHE_TTL = float(os.getenv('BOT_TOPIC_CACHE_TTL', 3600))  # also dropped whenever a Topic changes
+
+# Circuit breaker for upstream provider APIs, shared through Redis
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 3))  # failures within the window that open it
+CIRCUIT_FAILURE_WINDOW = int(os.getenv('CIRCUIT_FAILURE_WINDOW', 60))
+CIRCUIT_OPEN_SECONDS = int(os.getenv('CIRCUIT_OPEN_SECONDS', 30))  # first open period, doubled on every re-trip
+CIRCUIT_MAX_OPEN_SECONDS = int(os.getenv('CIRCUIT_MAX_OPEN_SECONDS', 600))
+CIRCUIT_PROBE_TIMEOUT = int(os.getenv('CIRCUIT_PROBE_TIMEOUT', 30))  # how long one half-open probe may take
+
+# Async HTTP client used by the providers inside the bot process
+PROVIDER_HTTP_TIMEOUT = float(os.getenv('PROVIDER_HTTP_TIMEOUT', 10))
+PROVIDER_HTTP_MAX_CONNECTIONS = int(os.getenv('PROVIDER_HTTP_MAX_CONNECTIONS', 20))
+PROVIDER_HTTP_MAX_KEEPALIVE = int(os.getenv('PROVIDER_HTTP_MAX_KEEPALIVE', 10))
+# Point this at a local stub Bot API server to exercise broadcasts without Telegram
+TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL', 'https://api.telegram.org/bot')
+
+# Update ingestion: 'polling' for development, 'webhook' to receive updates through smart_bot.asgi
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+BOT_WEBHOOK_URL = os.getenv('BOT_WEBHOOK_URL')  # public HTTPS URL registered with Telegram
+BOT_WEBHOOK_PATH = '/' + os.getenv('BOT_WEBHOOK_PATH', 'telegram/webhook/').lstrip('/')
+BOT_WEBHOOK_SECRET = os.getenv('BOT_WEBHOOK_SECRET')  # echoed by Telegram in X-Telegram-Bot-Api-Secret-Token
+BOT_WEBHOOK_MAX_CONNECTIONS = int(os.getenv('BOT_WEBHOOK_MAX_CONNECTIONS', 40))
+
+# Updates handled at once by one bot process (ordered per chat) and the threads running their queries
+BOT_CONCURRENT_UPDATES = int(os.getenv('BOT_CONCURRENT_UPDATES', 64))
+BOT_DB_THREADS = int(os.getenv('BOT_DB_THREADS', 10))  # each borrows a pooled connection per call; keep <= DB_POOL_MAX_SIZE
+
+# Prometheus: the API serves /metrics; the polling bot and Celery workers start their own endpoint (0 disables)
+BOT_METRICS_PORT = int(os.getenv('BOT_METRICS_PORT', 9101))
+WORKER_METRICS_PORT = int(os.getenv('WORKER_METRICS_PORT', 9102))
+
+# API request profiling: staff opt in per request with an `X-Profile: 1` (or `cprofile`) header;
+# a share of all requests can be profiled too. The slowest profiles are kept in Redis.
+REQUEST_PROFILING_SAMPLE_RATE = float(os.getenv('REQUEST_PROFILING_SAMPLE_RATE', 0))
+REQUEST_PROFILING_KEEP = int(os.getenv('REQUEST_PROFILING_KEEP', 50))
 
 # Redis Settings
 REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
@@ -17,8 +17,12 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from topics import urls as topics_urls
+from smart_bot.views import DatabasePoolStatsView, SlowRequestsView, metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('api/', include(topics_urls))
+    path('api/', include(topics_urls)),
+    path('api/health/db-pool/', DatabasePoolStatsView.as_view(), name='db-pool-stats'),
+    path('api/health/slow-requests/', SlowRequestsView.as_view(), name='slow-requests'),
+    path('metrics', metrics, name='metrics'),
 ]
@@ -0,0 +1,36 @@
+from django.http import HttpResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from smart_bot.dbpool import pool_stats
+from smart_bot.metrics import QUEUE_REGISTRY, collector_registry
+from smart_bot.profiling import clear_slow_requests, slow_requests
+
+
+class DatabasePoolStatsView(APIView):
+    """Connection pool usage of the API process serving the request (staff only)."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(pool_stats())
+
+
+
+class SlowRequestsView(APIView):
+    """Slowest profiled API requests, across every API process (staff only)."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(slow_requests())
+
+    def delete(self, request):
+        clear_slow_requests()
+        return Response(status=204)
+
+
+def metrics(request):
+    """Prometheus scrape endpoint, aggregated over worker processes in multiprocess mode."""
+    output = generate_latest(collector_registry()) + generate_latest(QUEUE_REGISTRY)
+    return HttpResponse(output, content_type=CONTENT_TYPE_LATEST)
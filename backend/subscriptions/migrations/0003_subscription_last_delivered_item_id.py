@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0002_alter_subscription_topic_and_more'),
+        ('topics', '0002_feeditem_content'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscription',
+            name='last_delivered_item_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['topic', 'last_delivered_item_id'], name='subscriptio_topic_i_a3c7bf_idx'),
+        ),
+    ]
@@ -1,13 +1,61 @@
-from django.db import models
+from django.db import connections, models
 from users.models import CustomUser
 
+
+class SubscriptionQuerySet(models.QuerySet):
+    def subscribe(self, user_id, topic_ids):
+        """
+        Subscribe a user to `topic_ids` with one INSERT ... ON CONFLICT DO NOTHING.
+
+        Returns the set of topic ids that were newly subscribed; topics the
+        user already follows are left untouched.
+        """
+        topic_ids = list(topic_ids)
+        if not topic_ids:
+            return set()
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} (user_id, topic_id, created_at) "
+                f"SELECT %s, topic_id, now() FROM unnest(%s::bigint[]) AS topic_id "
+                f"ON CONFLICT (user_id, topic_id) DO NOTHING "
+                f"RETURNING topic_id",
+                [user_id, topic_ids],
+            )
+            return {topic_id for topic_id, in cursor.fetchall()}
+
+    def unsubscribe(self, user_id, topic_ids):
+        """Delete a user's subscriptions to `topic_ids` in one query; returns the removed topic ids."""
+        topic_ids = list(topic_ids)
+        if not topic_ids:
+            return set()
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {table} WHERE user_id = %s AND topic_id = ANY(%s::bigint[]) "
+                f"RETURNING topic_id",
+                [user_id, topic_ids],
+            )
+            return {topic_id for topic_id, in cursor.fetchall()}
+
+
 class Subscription(models.Model):
     user = models.ForeignKey('users.CustomUser', on_delete=models.CASCADE)
     topic = models.ForeignKey('topics.Topic', on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Delivery ledger: id of the last FeedItem sent for this topic. A plain integer rather
+    # than a ForeignKey so pruning old feed items never cascades into subscriptions.
+    last_delivered_item_id = models.BigIntegerField(null=True, blank=True)
+
+    objects = SubscriptionQuerySet.as_manager()
 
     class Meta:
         unique_together = ('user', 'topic')
+        indexes = [
+            models.Index(fields=['topic', 'last_delivered_item_id']),
+        ]
 
     def __str__(self):
         return f'{self.user} → {self.topic}'
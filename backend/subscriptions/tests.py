@@ -1,3 +1,37 @@
 from django.test import TestCase
 
-# Create your tests here.
+from subscriptions.models import Subscription
+from topics.models import Topic
+from users.models import CustomUser
+
+
+class SubscriptionQuerySetTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(username='reader', telegram_id='42')
+        self.crypto = Topic.objects.create(name='crypto')
+        self.stocks = Topic.objects.create(name='stocks')
+
+    def _topic_ids(self):
+        return set(Subscription.objects.filter(user=self.user).values_list('topic_id', flat=True))
+
+    def test_subscribe_returns_only_new_topics_in_one_query(self):
+        existing = Subscription.objects.create(user=self.user, topic=self.crypto, last_delivered_item_id=7)
+        with self.assertNumQueries(1):
+            subscribed = Subscription.objects.subscribe(self.user.pk, [self.crypto.pk, self.stocks.pk])
+        self.assertEqual(subscribed, {self.stocks.pk})
+        self.assertEqual(self._topic_ids(), {self.crypto.pk, self.stocks.pk})
+        # The existing row is left as it was
+        existing.refresh_from_db()
+        self.assertEqual(existing.last_delivered_item_id, 7)
+
+    def test_unsubscribe_returns_only_removed_topics_in_one_query(self):
+        Subscription.objects.create(user=self.user, topic=self.crypto)
+        with self.assertNumQueries(1):
+            removed = Subscription.objects.unsubscribe(self.user.pk, [self.crypto.pk, self.stocks.pk])
+        self.assertEqual(removed, {self.crypto.pk})
+        self.assertEqual(self._topic_ids(), set())
+
+    def test_no_topics_runs_no_query(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(Subscription.objects.subscribe(self.user.pk, []), set())
+            self.assertEqual(Subscription.objects.unsubscribe(self.user.pk, []), set())
@@ -0,0 +1,302 @@
+"""
+Benchmarks for the ingestion, provider and broadcast paths.
+
+Run through `manage.py benchmark`, which creates a throwaway test database.
+Telegram and the upstream provider APIs are replaced by a local stub HTTP
+server; provider caches use the configured Redis and are cleaned up after.
+"""
+import json
+import math
+import resource
+import threading
+import time
+import tracemalloc
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, NamedTuple
+from unittest import mock
+
+import pandas as pd
+import yfinance as yf
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from news_providers import cache, crypto, news, stocks
+from news_providers.redis_client import r
+from subscriptions.models import Subscription
+from topics.models import FeedItem, Topic
+from topics.tasks import ingest_provider_task, send_topic_updates_task
+from users.models import CustomUser, delivery_slot_for
+
+TOPICS = ('crypto', 'stocks', 'news')
+PROVIDER_WARM_CALLS = 1000
+
+
+class Budget(NamedTuple):
+    """Limits for one run of a path; either may depend on the seeded size `n`."""
+    max_queries: Callable[[int], int]
+    max_seconds: Callable[[int], float]
+
+
+# Broadcast cost may grow with recipients only through the batched claims (2000 rows);
+# each topic adds a final, short claim
+BUDGETS = {
+    'broadcast': Budget(lambda n: 3 + 2 * len(TOPICS) + math.ceil(n / 2000), lambda n: 10 + n / 200),
+    'broadcast (nothing pending)': Budget(lambda n: 3 + len(TOPICS), lambda n: 2 + n / 20000),
+    # Each includes creating the topic
+    'ingest crypto': Budget(lambda n: 8, lambda n: 2),
+    'ingest stocks': Budget(lambda n: 8, lambda n: 2),
+    'ingest news': Budget(lambda n: 8, lambda n: 2),
+    'crypto provider (cold)': Budget(lambda n: 0, lambda n: 2),
+    'news provider (cold)': Budget(lambda n: 0, lambda n: 2),
+    'stocks provider (cold)': Budget(lambda n: 0, lambda n: 2),
+    'providers (warm)': Budget(lambda n: 0, lambda n: 1),
+}
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    size: int
+    seconds: float
+    operations: int
+    queries: int
+    peak_bytes: int
+    failures: list = field(default_factory=list)
+
+    @property
+    def rate(self):
+        return self.operations / self.seconds if self.seconds else 0.0
+
+
+def _max_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # KiB on Linux
+
+
+def measure(name, run, size=0, trace_memory=True):
+    """
+    Run `run()` once, recording wall time, SQL queries and peak memory.
+
+    `run` returns the number of operations it performed (messages, calls...).
+    Peak memory comes from tracemalloc, or with `trace_memory=False` (for paths
+    that tracemalloc would slow down several times) from the growth of the
+    process's peak RSS. The result lists every budget from BUDGETS the run exceeded.
+    """
+    rss_before = _max_rss()
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            operations = run()
+            seconds = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else _max_rss() - rss_before
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+    result = BenchmarkResult(name, size, seconds, operations, len(queries), peak)
+    budget = BUDGETS[name]
+    if result.queries > budget.max_queries(size):
+        result.failures.append(f'{result.queries} queries > budget {budget.max_queries(size)}')
+    if result.seconds > budget.max_seconds(size):
+        result.failures.append(f'{result.seconds:.2f}s > budget {budget.max_seconds(size):.2f}s')
+    return result
+
+
+# Stub upstream APIs
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real APIs
+
+    def do_GET(self):
+        self._dispatch()
+
+    def do_POST(self):
+        self._dispatch()
+
+    def _dispatch(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        path = self.path.split('?', 1)[0]
+        if path.startswith('/bot'):
+            body = {'ok': True, 'result': self._bot_result(path.rsplit('/', 1)[-1])}
+        elif path == '/coingecko/trending':
+            body = {'coins': [
+                {'item': {'name': f'Coin {i}', 'symbol': f'c{i}', 'market_cap_rank': i, 'price_btc': 0.0001 * i}}
+                for i in range(1, 8)
+            ]}
+        elif path == '/newsapi/top-headlines':
+            body = {'articles': [
+                {'title': f'Headline {i}', 'source': {'name': 'Stub'}, 'url': f'https://example.com/{i}',
+                 'description': 'Lorem ipsum ' * 20}
+                for i in range(1, 6)
+            ]}
+        else:
+            self.send_error(404)
+            return
+        self.server.requests += 1
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _bot_result(self, method):
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Benchmark', 'username': 'benchmark_bot'}
+        return {'message_id': 1, 'date': int(time.time()), 'chat': {'id': 1, 'type': 'private'}, 'text': ''}
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def stub_server():
+    """Serve stub Telegram, CoinGecko and NewsAPI endpoints on a free local port."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _StubHandler)
+    server.daemon_threads = True
+    server.requests = 0
+    thread = threading.Thread(target=server.serve_forever, name='benchmark-stub', daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_address[1]}', server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _stub_download(tickers, **kwargs):
+    """yf.download stand-in: five days of closes per ticker, grouped by ticker."""
+    index = pd.date_range(end=pd.Timestamp.today().normalize(), periods=5)
+    frame = pd.concat(
+        {symbol: pd.DataFrame({'Close': [100.0 + i + offset for offset in range(5)]}, index=index)
+         for i, symbol in enumerate(tickers)},
+        axis=1,
+    )
+    return frame
+
+
+class _StubTicker:
+    """yf.Ticker stand-in for company name lookups."""
+
+    def __init__(self, symbol):
+        self.info = {'longName': f'{symbol} Inc.'}
+
+
+@contextmanager
+def stubbed_upstreams(base_url):
+    """Point the bot and the providers at the stub server for the duration of the block."""
+    with ExitStack() as stack:
+        stack.enter_context(override_settings(
+            BOT_TOKEN='123456:benchmark',
+            TELEGRAM_API_BASE_URL=f'{base_url}/bot',
+            # Measure our own overhead, not Telegram's rate limits
+            BROADCAST_GLOBAL_RATE=1_000_000,
+            # Ingestion must not queue pushes on the real broker
+            TOPIC_PUSH_ENABLED=False,
+        ))
+        stack.enter_context(mock.patch.object(crypto, 'COINGECKO_TRENDING_URL', f'{base_url}/coingecko/trending'))
+        stack.enter_context(mock.patch.object(news, 'NEWS_API_URL', f'{base_url}/newsapi/top-headlines'))
+        stack.enter_context(mock.patch.object(yf, 'download', _stub_download))
+        stack.enter_context(mock.patch.object(yf, 'Ticker', _StubTicker))
+        yield
+
+
+# Data
+
+def reset_data():
+    """Empty the benchmarked tables in one statement (no per-row delete signals)."""
+    tables = ', '.join(
+        connection.ops.quote_name(model._meta.db_table)
+        for model in (Subscription, FeedItem, Topic, CustomUser)
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(f'TRUNCATE {tables} RESTART IDENTITY CASCADE')
+
+
+def seed(n, batch_size=5000):
+    """`n` users, each subscribed to one topic, and one feed item per topic."""
+    reset_data()
+    topics = Topic.objects.bulk_create(Topic(name=name) for name in TOPICS)
+    for topic in topics:
+        FeedItem.objects.create(
+            topic=topic, title=f'{topic.name} benchmark update', content='Benchmark content ' * 20,
+            url='https://example.com', source='benchmark',
+        )
+    users = CustomUser.objects.bulk_create(
+        (CustomUser(username=f'bench_{i}', telegram_id=str(1_000_000 + i), password='',
+                    delivery_slot=delivery_slot_for(1_000_000 + i)) for i in range(n)),
+        batch_size=batch_size,
+    )
+    Subscription.objects.bulk_create(
+        (Subscription(user=user, topic=topics[i % len(topics)]) for i, user in enumerate(users)),
+        batch_size=batch_size,
+    )
+
+
+# Paths
+
+def run_broadcast(n):
+    """Seed `n` subscribers, broadcast to all of them, then broadcast again with nothing new."""
+    seed(n)
+
+    def broadcast():
+        result = send_topic_updates_task()
+        if not isinstance(result, dict):
+            raise RuntimeError(result)
+        if result['sent'] != n:
+            raise RuntimeError(f"Sent {result['sent']} of {n} messages: {result}")
+        return result['sent']
+
+    return [
+        measure('broadcast', broadcast, n, trace_memory=False),
+        measure('broadcast (nothing pending)', lambda: send_topic_updates_task()['sent'], n),
+    ]
+
+
+def _provider_keys():
+    keys = [
+        crypto.get_crypto_records.cache_key(),
+        news.get_news_records.cache_key(),
+        stocks.get_stocks_records.cache_key(),
+    ]
+    keys += [f'{key}:lkg' for key in keys]
+    keys += [f'circuit:{prefix}' for prefix in (crypto.CACHE_KEY, news.CACHE_KEY, stocks.CACHE_KEY)]
+    keys += [stocks.QUOTE_CACHE_KEY.format(symbol=symbol) for symbol in settings.STOCKS_TICKERS]
+    keys.append(stocks.NAMES_KEY)
+    return keys
+
+
+def run_providers():
+    """Cold provider refreshes against the stub APIs, then warm reads from the in-process cache."""
+    keys = _provider_keys()
+    r.delete(*keys)
+    cache.l1.clear()
+    try:
+        results = [
+            measure('ingest crypto', lambda: ingest_provider_task('crypto')['items']),
+            measure('ingest stocks', lambda: ingest_provider_task('stocks')['items']),
+            measure('ingest news', lambda: ingest_provider_task('news', {'category': 'business'})['items']),
+            measure('crypto provider (cold)', lambda: len(crypto.get_crypto_records(force_refresh=True))),
+            measure('news provider (cold)', lambda: len(news.get_news_records(force_refresh=True))),
+            measure('stocks provider (cold)', lambda: len(stocks.get_stocks_records(force_refresh=True))),
+        ]
+
+        def warm():
+            for _ in range(PROVIDER_WARM_CALLS):
+                crypto.get_crypto_records()
+                news.get_news_records()
+                stocks.get_stocks_records()
+            return PROVIDER_WARM_CALLS * 3
+
+        results.append(measure('providers (warm)', warm))
+        return results
+    finally:
+        # The stub data must not outlive the benchmark in a shared Redis
+        r.delete(*keys)
+        cache.l1.clear()
@@ -0,0 +1,478 @@
+import asyncio
+import contextlib
+import logging
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import NamedTuple
+
+from celery.exceptions import SoftTimeLimitExceeded
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
+from telegram import Bot
+from telegram.error import Forbidden, BadRequest, RetryAfter, NetworkError
+from telegram.request import HTTPXRequest
+
+from news_providers.redis_client import async_client, r
+from smart_bot.metrics import TELEGRAM_MESSAGES
+from subscriptions.models import Subscription
+from topics.models import FeedItem
+from users.models import DELIVERY_SLOTS, CustomUser
+
+logger = logging.getLogger(__name__)
+
+SHARED_RATE_LIMIT_KEY = 'broadcast:rate_limit'
+SLOT_TICK_KEY = 'broadcast:last_slot_tick'
+
+
+class OutgoingMessage(NamedTuple):
+    chat_id: str
+    text: str
+    subscription_id: int = None
+    item_id: int = None
+    previous_item_id: int = None  # ledger value before the message was claimed
+
+
+class TopicBroadcast(NamedTuple):
+    topic_id: int
+    item_id: int
+    text: str
+
+
+class BroadcastPlan(NamedTuple):
+    topics: list
+    subscriptions: object  # Subscription queryset the recipients are read from
+    skipped: int  # subscriptions to topics that have nothing to send
+    batch_size: int = 2000
+
+
+@dataclass
+class BroadcastResult:
+    sent: int = 0
+    failed: int = 0
+    skipped: int = 0
+    retried: int = 0
+    rate_limited: int = 0
+    elapsed: float = 0.0
+    delivered: list = field(default_factory=list, repr=False)
+
+    @property
+    def throughput(self):
+        """Messages delivered per second."""
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            'sent': self.sent,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'retried': self.retried,
+            'rate_limited': self.rate_limited,
+            'elapsed': round(self.elapsed, 3),
+            'throughput': round(self.throughput, 2),
+        }
+
+
+class TokenBucket:
+    """Async token bucket refilled continuously at `rate` tokens per second."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# Refill and take one token atomically; returns how long to wait when the bucket is empty.
+# Redis TIME keeps every worker on the same clock.
+REDIS_TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], 60)
+return tostring(wait)
+"""
+
+
+class RedisTokenBucket:
+    """Token bucket shared through Redis by every process using the same key."""
+
+    def __init__(self, client, key, rate, capacity=None):
+        self.key = key
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self._script = client.register_script(REDIS_TOKEN_BUCKET_SCRIPT)
+
+    async def acquire(self):
+        while True:
+            wait = float(await self._script(keys=[self.key], args=[self.rate, self.capacity]))
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+
+class BroadcastEngine:
+    """
+    Send messages through one shared Bot session with bounded concurrency.
+
+    A global token bucket keeps the overall rate under Telegram's broadcast
+    limit and a bucket per chat keeps each chat under its own limit.
+    A RetryAfter response pauses every sender for the requested time.
+    """
+
+    def __init__(self, bot, concurrency=None, global_rate=None, per_chat_rate=None, max_retries=None,
+                 global_bucket=None):
+        self.bot = bot
+        self.concurrency = concurrency or settings.BROADCAST_CONCURRENCY
+        self.global_bucket = global_bucket or TokenBucket(global_rate or settings.BROADCAST_GLOBAL_RATE)
+        self.per_chat_rate = per_chat_rate or settings.BROADCAST_PER_CHAT_RATE
+        self.max_retries = max_retries if max_retries is not None else settings.BROADCAST_MAX_RETRIES
+        self._chat_buckets = {}
+        self._paused_until = 0.0
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate, capacity=1)
+        return bucket
+
+    async def _wait_if_paused(self):
+        delay = self._paused_until - time.monotonic()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self._paused_until - time.monotonic()
+
+    async def run(self, messages, result=None):
+        """
+        Send every message and return a BroadcastResult.
+
+        Pass `result` to keep the counts (and delivered messages) of a run that
+        gets interrupted, e.g. by a task time limit.
+        """
+        result = result if result is not None else BroadcastResult()
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        started = time.monotonic()
+
+        workers = [
+            asyncio.create_task(self._worker(queue, result))
+            for _ in range(self.concurrency)
+        ]
+
+        async def produce():
+            for message in messages:
+                await queue.put(message)
+            for _ in workers:
+                await queue.put(None)
+
+        # A worker that raises (e.g. a task time limit) ends the run instead of leaving
+        # the producer blocked on a full queue; the caller cancels what is left
+        await asyncio.gather(produce(), *workers)
+
+        result.elapsed += time.monotonic() - started
+        return result
+
+    async def _worker(self, queue, result):
+        while True:
+            message = await queue.get()
+            if message is None:
+                return
+            await self._send(message, result)
+
+    async def _send(self, message, result):
+        attempt = 0
+        while True:
+            await self._chat_bucket(message.chat_id).acquire()
+            await self._wait_if_paused()
+            await self.global_bucket.acquire()
+            try:
+                await self.bot.send_message(
+                    chat_id=message.chat_id,
+                    text=message.text,
+                    parse_mode='Markdown'
+                )
+                result.sent += 1
+                TELEGRAM_MESSAGES.labels('sent').inc()
+                result.delivered.append(message)
+                logger.debug(f"Sent update to user {message.chat_id}")
+                return
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if hasattr(retry_after, 'total_seconds'):
+                    retry_after = retry_after.total_seconds()
+                result.rate_limited += 1
+                TELEGRAM_MESSAGES.labels('rate_limited').inc()
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                logger.warning(f"Rate limited by Telegram, pausing broadcast for {retry_after}s")
+                error, backoff = e, 0
+            except (Forbidden, BadRequest) as e:
+                # Blocked bot, deleted account or malformed chat id: retrying won't help
+                result.failed += 1
+                TELEGRAM_MESSAGES.labels('failed').inc()
+                logger.error(f"Error sending message to {message.chat_id}: {e}")
+                return
+            except NetworkError as e:
+                error, backoff = e, 2 ** attempt
+            except SoftTimeLimitExceeded:
+                raise
+            except Exception as e:
+                result.failed += 1
+                TELEGRAM_MESSAGES.labels('failed').inc()
+                logger.error(f"Error sending message to {message.chat_id}: {e}")
+                return
+
+            if attempt >= self.max_retries:
+                result.failed += 1
+                TELEGRAM_MESSAGES.labels('failed').inc()
+                logger.error(f"Error sending message to {message.chat_id} after {attempt + 1} attempts: {error}")
+                return
+            attempt += 1
+            result.retried += 1
+            TELEGRAM_MESSAGES.labels('retried').inc()
+            if backoff:
+                await asyncio.sleep(backoff)
+
+
+def render_topic_update(topic_name, feed_item):
+    """Build the Markdown text sent to subscribers of a topic."""
+    text = f"📰 *{topic_name.capitalize()} Update*\n\n"
+    text += f"{feed_item.title}\n\n"
+
+    # Add content if available
+    if feed_item.content:
+        text += f"{feed_item.content}\n\n"
+
+    text += f"🔗 {feed_item.url}"
+    return text
+
+
+def latest_feed_items(topic_ids=None):
+    """Return {topic_id: latest FeedItem} using a single DISTINCT ON query."""
+    items = (
+        FeedItem.objects
+        .select_related('topic')
+        .order_by('topic_id', '-created_at', '-id')
+        .distinct('topic_id')
+    )
+    if topic_ids is not None:
+        items = items.filter(topic_id__in=topic_ids)
+    return {item.topic_id: item for item in items}
+
+
+def pending_deliveries(subscriptions, topic):
+    """
+    Narrow `subscriptions` to `topic`'s rows whose ledger is behind its latest item.
+
+    Up-to-date subscribers are filtered out by the database, so the work of a
+    broadcast grows with new content rather than with the subscriber count.
+    """
+    return subscriptions.filter(
+        Q(last_delivered_item_id__isnull=True) | Q(last_delivered_item_id__lt=topic.item_id),
+        topic_id=topic.topic_id,
+    )
+
+
+def plan_broadcast(subscriptions=None, batch_size=2000, topic_ids=None):
+    """
+    Render each topic's update once; recipients are read batch by batch while sending.
+
+    `subscriptions` may be any Subscription queryset (a shard, a slot...).
+    `topic_ids` limits the broadcast to those topics' subscribers.
+    """
+    if subscriptions is None:
+        subscriptions = Subscription.objects.all()
+    if topic_ids is not None:
+        subscriptions = subscriptions.filter(topic_id__in=topic_ids)
+
+    items = latest_feed_items(topic_ids)
+    if not items:
+        return BroadcastPlan([], subscriptions, subscriptions.count(), batch_size)
+
+    topics = [
+        TopicBroadcast(topic_id, item.id, render_topic_update(item.topic.name, item))
+        for topic_id, item in items.items()
+    ]
+    skipped = subscriptions.exclude(topic_id__in=list(items)).count()
+    return BroadcastPlan(topics, subscriptions, skipped, batch_size)
+
+
+def due_delivery_slots(now=None):
+    """
+    Delivery slots whose minute has come since the previous tick.
+
+    Slot `n` is due at minute `n` of every UTC hour. The last minute handled is
+    swapped atomically in Redis, so overlapping ticks never take the same slot
+    twice and a late or missed tick catches up on the slots it skipped.
+    """
+    minute = int((now if now is not None else time.time()) // 60)
+    try:
+        previous = r.getset(SLOT_TICK_KEY, minute)
+    except Exception as e:
+        logger.warning(f"Could not read the last slot tick, delivering the current slot only: {e}")
+        previous = None
+    previous = int(previous) if previous is not None else minute - 1
+    first = max(previous + 1, minute - DELIVERY_SLOTS + 1)
+    return [m % DELIVERY_SLOTS for m in range(first, minute + 1)]
+
+
+def claim_deliveries(subscriptions, topic, after_id=0, batch_size=2000):
+    """
+    Claim up to `batch_size` of `topic`'s pending subscriptions with ids above `after_id`.
+
+    One UPDATE ... RETURNING advances their ledger to the topic's item before
+    anything is sent, so overlapping broadcasts (a push and the scheduled run,
+    or a redelivered task) never pick the same row: rows locked by another
+    claim are skipped, and claimed rows are no longer pending. Claims that
+    could not be delivered are handed back with `release_claims`.
+    """
+    candidates = (
+        pending_deliveries(subscriptions, topic)
+        .filter(id__gt=after_id)
+        .order_by('id')
+        .only('id', 'last_delivered_item_id')
+        .select_for_update(skip_locked=True, of=('self',))[:batch_size]
+    )
+    connection = connections[candidates.db]
+    table = connection.ops.quote_name(Subscription._meta.db_table)
+    users = connection.ops.quote_name(CustomUser._meta.db_table)
+    with transaction.atomic(using=candidates.db), connection.cursor() as cursor:
+        sql, params = candidates.query.sql_with_params()
+        cursor.execute(
+            f"WITH pending AS ({sql}) "
+            f"UPDATE {table} AS s SET last_delivered_item_id = %s "
+            f"FROM pending, {users} AS u "
+            f"WHERE s.id = pending.id AND u.id = s.user_id "
+            f"RETURNING s.id, u.telegram_id, pending.last_delivered_item_id",
+            [*params, topic.item_id],
+        )
+        rows = sorted(cursor.fetchall())
+    return [
+        OutgoingMessage(telegram_id, topic.text, subscription_id, topic.item_id, previous_item_id)
+        for subscription_id, telegram_id, previous_item_id in rows
+    ]
+
+
+def release_claims(messages, batch_size=1000):
+    """
+    Put the ledger of undelivered `messages` back to what it was before they were claimed.
+
+    Rows a later broadcast has since moved past the message's item are left alone.
+    """
+    by_item = defaultdict(list)
+    for message in messages:
+        if message.subscription_id is not None:
+            by_item[message.item_id, message.previous_item_id].append(message.subscription_id)
+
+    released = 0
+    for (item_id, previous_item_id), subscription_ids in by_item.items():
+        for start in range(0, len(subscription_ids), batch_size):
+            batch = subscription_ids[start:start + batch_size]
+            released += (
+                Subscription.objects
+                .filter(id__in=batch, last_delivered_item_id=item_id)
+                .update(last_delivered_item_id=previous_item_id)
+            )
+    return released
+
+
+def pending_batches(plan):
+    """
+    Claim and yield lists of up to `plan.batch_size` messages for subscribers behind their topic.
+
+    Each batch is claimed, by keyset on id, only once the previous one has
+    been sent.
+    """
+    for topic in plan.topics:
+        last_id = 0
+        while True:
+            batch = claim_deliveries(plan.subscriptions, topic, last_id, plan.batch_size)
+            if batch:
+                yield batch
+            if len(batch) < plan.batch_size:
+                break
+            last_id = batch[-1].subscription_id
+
+
+def build_bot(token=None, base_url=None, pool_size=None):
+    """Create a Bot whose HTTP pool fits the broadcast concurrency."""
+    return Bot(
+        token=token or settings.BOT_TOKEN,
+        base_url=base_url or settings.TELEGRAM_API_BASE_URL,
+        request=HTTPXRequest(connection_pool_size=pool_size or settings.BROADCAST_CONCURRENCY),
+    )
+
+
+async def _start_engine(stack, bot=None, shared_rate_limit=False, **options):
+    """Open the Bot session (and the shared rate limiter) on `stack` and return an engine."""
+    bot = bot or build_bot(pool_size=options.get('concurrency'))
+    if shared_rate_limit:
+        # Every shard draws from the same Redis bucket so their combined rate stays under the cap
+        redis_client = async_client()
+        stack.push_async_callback(redis_client.aclose)
+        options['global_bucket'] = RedisTokenBucket(
+            redis_client, SHARED_RATE_LIMIT_KEY, options.get('global_rate') or settings.BROADCAST_GLOBAL_RATE
+        )
+    await stack.enter_async_context(bot)
+    return BroadcastEngine(bot, **options)
+
+
+async def broadcast_async(messages, result=None, **options):
+    async with contextlib.AsyncExitStack() as stack:
+        engine = await _start_engine(stack, **options)
+        return await engine.run(messages, result)
+
+
+def broadcast(messages, **options):
+    """Send `messages` on a single event loop and return a BroadcastResult."""
+    return asyncio.run(broadcast_async(messages, **options))
+
+
+def broadcast_batches(batches, result=None, **options):
+    """
+    Send each list of messages from `batches` in turn, on one event loop and one Bot session.
+
+    `batches` is advanced between sends, while the loop is idle, so it may
+    run ORM queries. An interrupted send (e.g. a task time limit) cancels the
+    messages in flight; `result` then holds what was delivered.
+    """
+    result = result if result is not None else BroadcastResult()
+    loop = asyncio.new_event_loop()
+    stack = contextlib.AsyncExitStack()
+    try:
+        engine = loop.run_until_complete(_start_engine(stack, **options))
+        for batch in batches:
+            loop.run_until_complete(engine.run(batch, result))
+        return result
+    finally:
+        pending = asyncio.all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        if pending:
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        loop.run_until_complete(stack.aclose())
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
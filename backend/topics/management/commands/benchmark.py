@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.template.defaultfilters import filesizeformat
+
+from topics.benchmarks import run_broadcast, run_providers, stub_server, stubbed_upstreams
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the broadcast, ingestion and provider paths on a throwaway test database '
+        'against stub Telegram and provider APIs. Fails when a path exceeds its query or time budget.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='1000,10000,100000',
+            help='Comma-separated subscriber counts to seed for the broadcast path (default: 1000,10000,100000)',
+        )
+        parser.add_argument('--skip-broadcast', action='store_true', help='Do not benchmark broadcasts')
+        parser.add_argument('--skip-providers', action='store_true', help='Do not benchmark ingestion and providers')
+        parser.add_argument('--keepdb', action='store_true', help='Keep the test database between runs')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help='Replace a leftover test database without asking')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',') if size.strip()]
+        except ValueError:
+            raise CommandError('--sizes must be a comma-separated list of integers')
+
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=not options['interactive'], keepdb=options['keepdb']
+        )
+        results = []
+        try:
+            with stub_server() as (base_url, server), stubbed_upstreams(base_url):
+                if not options['skip_providers']:
+                    results += run_providers()
+                if not options['skip_broadcast']:
+                    for size in sizes:
+                        self.stdout.write(f'Broadcasting to {size} subscribers...')
+                        results += run_broadcast(size)
+            self.stdout.write(f'Stub server answered {server.requests} requests')
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+
+        self.report(results)
+        failed = [result for result in results if result.failures]
+        if failed:
+            raise CommandError(
+                'Budget exceeded: ' + '; '.join(
+                    f"{result.name} [{result.size}]: {', '.join(result.failures)}" for result in failed
+                )
+            )
+        self.stdout.write(self.style.SUCCESS('All paths within budget'))
+
+    def report(self, results):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{'path':<30}{'size':>8}{'seconds':>10}{'ops':>9}{'ops/s':>11}{'queries':>9}{'peak mem':>11}"
+        ))
+        for result in results:
+            line = (
+                f'{result.name:<30}{result.size:>8}{result.seconds:>10.3f}{result.operations:>9}'
+                f'{result.rate:>11.1f}{result.queries:>9}{filesizeformat(result.peak_bytes):>11}'
+            )
+            self.stdout.write(self.style.ERROR(line) if result.failures else line)
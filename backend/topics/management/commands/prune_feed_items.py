@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from topics.retention import feed_storage_sizes, prune_feed_items
+
+
+class Command(BaseCommand):
+    help = 'Delete expired feed items in batches and report FeedItem table and index sizes before and after.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Rows deleted per batch (default: FEED_PRUNE_BATCH_SIZE)')
+        parser.add_argument('--report-only', action='store_true', help='Only print storage sizes, do not delete')
+
+    def handle(self, *args, **options):
+        self.report('Before pruning' if not options['report_only'] else 'Feed storage')
+        if options['report_only']:
+            return
+
+        deleted = prune_feed_items(batch_size=options['batch_size'])
+        for topic, count in deleted.items():
+            self.stdout.write(f'  {topic}: {count} rows deleted')
+        self.stdout.write(self.style.SUCCESS(f'Deleted {sum(deleted.values())} feed items'))
+
+        # Space is reclaimed by (auto)vacuum; until then deleted rows show up as dead rows
+        self.report('After pruning')
+
+    def report(self, title):
+        sizes = feed_storage_sizes()
+        self.stdout.write(self.style.MIGRATE_HEADING(f'{title}:'))
+        if sizes is None:
+            self.stdout.write('  No statistics available for the feed item table')
+            return
+        self.stdout.write(
+            f"  table {filesizeformat(sizes['table_bytes'])}, "
+            f"indexes {filesizeformat(sizes['indexes_bytes'])}, "
+            f"total {filesizeformat(sizes['total_bytes'])}, "
+            f"{sizes['live_rows']} live / {sizes['dead_rows']} dead rows"
+        )
+        for name, size in sizes['indexes'].items():
+            self.stdout.write(f'    {name}: {filesizeformat(size)}')
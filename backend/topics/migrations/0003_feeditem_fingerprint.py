@@ -0,0 +1,42 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:30
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def backfill_fingerprints(apps, schema_editor):
+    # Only the oldest copy of each duplicate gets a fingerprint; later copies keep NULL
+    # so the unique constraint holds without deleting historical rows.
+    FeedItem = apps.get_model('topics', 'FeedItem')
+    seen = set()
+    batch = []
+    for item in FeedItem.objects.order_by('id').only('id', 'topic_id', 'content').iterator(chunk_size=2000):
+        normalized = ' '.join((item.content or '').split())
+        fingerprint = hashlib.sha256(f'{item.topic_id}:{normalized}'.encode('utf-8')).hexdigest()
+        if fingerprint in seen:
+            continue
+        seen.add(fingerprint)
+        item.fingerprint = fingerprint
+        batch.append(item)
+        if len(batch) >= 1000:
+            FeedItem.objects.bulk_update(batch, ['fingerprint'])
+            batch = []
+    if batch:
+        FeedItem.objects.bulk_update(batch, ['fingerprint'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('topics', '0002_feeditem_content'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feeditem',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+        migrations.RunPython(backfill_fingerprints, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('topics', '0003_feeditem_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='topic',
+            name='retention_days',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='feeditem',
+            index=models.Index(fields=['-created_at'], name='topics_feed_created_7d5cde_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feeditem',
+            index=models.Index(fields=['topic', '-created_at', 'id'], name='topics_feed_topic_i_fa19be_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:30
+
+from django.db import migrations
+from django.utils import timezone
+
+
+def remove_fetch_crypto_entry(apps, schema_editor):
+    # ingest-providers replaced this entry; DatabaseScheduler would keep running it forever
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+    PeriodicTasks = apps.get_model('django_celery_beat', 'PeriodicTasks')
+    deleted, _ = PeriodicTask.objects.filter(name='fetch-crypto-every-30-minutes').delete()
+    if deleted:
+        # Historical models send no signals; tell a running beat to reload its schedule
+        PeriodicTasks.objects.update_or_create(ident=1, defaults={'last_update': timezone.now()})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('topics', '0004_feeditem_indexes_topic_retention_days'),
+        ('django_celery_beat', '0019_alter_periodictasks_options'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_fetch_crypto_entry, migrations.RunPython.noop),
+    ]
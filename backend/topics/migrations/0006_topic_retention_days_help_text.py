@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('topics', '0005_remove_fetch_crypto_beat_entry'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='topic',
+            name='retention_days',
+            field=models.PositiveIntegerField(blank=True, help_text='Days to keep feed items; 0 keeps them forever, empty uses FEED_RETENTION_DAYS.', null=True),
+        ),
+    ]
@@ -1,13 +1,69 @@
-from django.db import models
+import hashlib
+
+from django.db import connections, models
+
+
+def content_fingerprint(topic_id, content):
+    """Hash of the topic and its whitespace-normalized content."""
+    normalized = ' '.join((content or '').split())
+    return hashlib.sha256(f'{topic_id}:{normalized}'.encode('utf-8')).hexdigest()
 
 class Topic(models.Model):
     name = models.CharField(max_length=100, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    retention_days = models.PositiveIntegerField(
+        null=True, blank=True,
+        help_text='Days to keep feed items; 0 keeps them forever, empty uses FEED_RETENTION_DAYS.',
+    )
 
     def __str__(self):
         return self.name
 
+class FeedItemQuerySet(models.QuerySet):
+    def insert_if_absent(self, items):
+        """
+        Insert the items whose fingerprint is not stored yet with one INSERT ... ON CONFLICT DO NOTHING.
+
+        Returns the items that were actually inserted, with their ids set; content
+        already stored, including by a concurrent insert, is left out.
+        """
+        pending = {}
+        for item in items:
+            if not item.fingerprint:
+                item.fingerprint = content_fingerprint(item.topic_id, item.content)
+            pending.setdefault(item.fingerprint, item)
+        if not pending:
+            return []
+
+        connection = connections[self.db]
+        fields = [field for field in self.model._meta.concrete_fields if not field.primary_key]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+        row = f"({', '.join(['%s'] * len(fields))})"
+        params = [
+            field.get_db_prep_save(field.pre_save(item, add=True), connection)
+            for item in pending.values()
+            for field in fields
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) VALUES {', '.join([row] * len(pending))} "
+                f"ON CONFLICT (fingerprint) DO NOTHING "
+                f"RETURNING id, fingerprint",
+                params,
+            )
+            ids = {fingerprint: pk for pk, fingerprint in cursor.fetchall()}
+
+        inserted = []
+        for fingerprint, item in pending.items():
+            if fingerprint in ids:
+                item.pk = ids[fingerprint]
+                item._state.adding = False
+                item._state.db = self.db
+                inserted.append(item)
+        return inserted
+
 class FeedItem(models.Model):
     topic = models.ForeignKey(Topic, on_delete=models.CASCADE, related_name='feed_items')
     title = models.CharField(max_length=255)
@@ -15,12 +71,22 @@ class FeedItem(models.Model):
     url = models.URLField()
     source = models.CharField(max_length=100)
     created_at = models.DateTimeField(auto_now_add=True)
+    fingerprint = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
+
+    objects = FeedItemQuerySet.as_manager()
 
     class Meta:
         indexes = [
             models.Index(fields=['-created_at']),
+            # Serves every per-topic "newest first" query: feed pages, latest item, pruning
+            models.Index(fields=['topic', '-created_at', 'id']),
         ]
 
+    def save(self, *args, **kwargs):
+        if not self.fingerprint:
+            self.fingerprint = content_fingerprint(self.topic_id, self.content)
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.title
 
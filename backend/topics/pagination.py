@@ -0,0 +1,16 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class FeedCursorPagination(CursorPagination):
+    """
+    Keyset pagination on created_at, newest first, with id breaking ties.
+
+    DRF's cursor holds the created_at of the page boundary, plus an offset only
+    for items sharing that exact timestamp, so a page reads a created_at range
+    of the (topic, -created_at, id) index instead of skipping every earlier row.
+    """
+    ordering = ('-created_at', 'id')
+    page_size = settings.FEED_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.FEED_MAX_PAGE_SIZE
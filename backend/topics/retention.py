@@ -0,0 +1,97 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from topics.models import Topic, FeedItem
+
+logger = logging.getLogger(__name__)
+
+
+def prune_feed_items(batch_size=None, pause=None):
+    """
+    Delete feed items older than each topic's retention window.
+
+    Rows go in small batches, each its own short DELETE, so pruning never holds
+    long locks. The newest item of a topic is always kept so broadcasts still
+    have something to send. Returns {topic name: deleted rows}.
+    """
+    batch_size = batch_size or settings.FEED_PRUNE_BATCH_SIZE
+    pause = settings.FEED_PRUNE_BATCH_PAUSE if pause is None else pause
+    now = timezone.now()
+    deleted = {}
+
+    for topic in Topic.objects.all():
+        days = topic.retention_days if topic.retention_days is not None else settings.FEED_RETENTION_DAYS
+        if not days:  # 0 keeps the topic's items forever
+            continue
+
+        newest_id = (
+            FeedItem.objects.filter(topic=topic)
+            .order_by('-created_at', '-id')
+            .values_list('id', flat=True)
+            .first()
+        )
+        expired = (
+            FeedItem.objects.filter(topic=topic, created_at__lt=now - timedelta(days=days))
+            .exclude(id=newest_id)
+            .order_by('created_at', 'id')
+            .values_list('id', flat=True)
+        )
+
+        count = 0
+        while True:
+            ids = list(expired[:batch_size])
+            if not ids:
+                break
+            count += FeedItem.objects.filter(id__in=ids).delete()[0]
+            if pause:
+                time.sleep(pause)
+
+        if count:
+            logger.info(f"Pruned {count} feed items older than {days} days from topic {topic.name}")
+        deleted[topic.name] = count
+
+    return deleted
+
+
+def feed_storage_sizes():
+    """Return table, index and dead-row figures for the FeedItem table (PostgreSQL)."""
+    table = FeedItem._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT pg_relation_size(c.oid), pg_indexes_size(c.oid), pg_total_relation_size(c.oid),
+                   s.n_live_tup, s.n_dead_tup
+            FROM pg_class c
+            JOIN pg_stat_user_tables s ON s.relid = c.oid
+            WHERE c.relname = %s
+            """,
+            [table],
+        )
+        row = cursor.fetchone()
+        cursor.execute(
+            """
+            SELECT indexrelname, pg_relation_size(indexrelid)
+            FROM pg_stat_user_indexes
+            WHERE relname = %s
+            ORDER BY indexrelname
+            """,
+            [table],
+        )
+        indexes = dict(cursor.fetchall())
+
+    if row is None:
+        return None
+    table_bytes, indexes_bytes, total_bytes, live_rows, dead_rows = row
+    return {
+        'table_bytes': table_bytes,
+        'indexes_bytes': indexes_bytes,
+        'total_bytes': total_bytes,
+        'live_rows': live_rows,
+        'dead_rows': dead_rows,
+        'indexes': indexes,
+    }
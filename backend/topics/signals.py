@@ -0,0 +1,12 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from news_providers.cache import publish_invalidation
+from topics.models import Topic
+
+TOPIC_TABLE_KEY = 'topics:table'  # name -> id table cached by the bot
+
+
+@receiver([post_save, post_delete], sender=Topic)
+def invalidate_topic_table(sender, **kwargs):
+    publish_invalidation(TOPIC_TABLE_KEY)
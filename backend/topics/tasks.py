@@ -1,94 +1,283 @@
-from celery import shared_task
+from celery import chord, group, shared_task
+from celery.exceptions import SoftTimeLimitExceeded
+from django.conf import settings
 from django.utils import timezone
-import asyncio
 import logging
+import math
+import time
 
-from news_providers.crypto import get_crypto_trending
+from news_providers.redis_client import r
+from news_providers.registry import get_provider, ingestion_jobs
+from smart_bot.metrics import INGEST_RUN_SECONDS
 from topics.models import Topic, FeedItem
 from subscriptions.models import Subscription
-from telegram import Bot
-from smart_bot.settings import BOT_TOKEN
+from topics.broadcast import (
+    BroadcastResult, broadcast_batches, due_delivery_slots, pending_batches, plan_broadcast, release_claims,
+)
+from topics.retention import prune_feed_items
 
 logger = logging.getLogger(__name__)
 
-@shared_task
-def fetch_crypto_news_task():
-    """Fetch crypto trending data and save to database."""
+PUSH_PENDING_KEY = 'broadcast:push:{topic_id}'
+
+def _time_limits(soft_time_limit):
+    return {'soft_time_limit': soft_time_limit, 'time_limit': soft_time_limit + settings.TASK_TIME_LIMIT_GRACE}
+
+# Long-running tasks are acknowledged once they finish, so a worker lost mid-run
+# hands them to another worker. Ingestion and pruning are idempotent; a broadcast
+# claims each batch in the delivery ledger before sending it, so a rerun never
+# resends, and a worker lost mid-batch leaves that batch's unsent messages claimed
+# until the topic's next item.
+INGEST_TASK = {'acks_late': True, **_time_limits(settings.INGEST_SOFT_TIME_LIMIT)}
+BROADCAST_TASK = {'acks_late': True, **_time_limits(settings.BROADCAST_SOFT_TIME_LIMIT)}
+MAINTENANCE_TASK = {'acks_late': True, **_time_limits(settings.MAINTENANCE_SOFT_TIME_LIMIT)}
+
+@shared_task(**INGEST_TASK)
+def ingest_provider_task(name, params=None):
+    """Store one provider's current records, for one parameter set, as a feed item snapshot."""
+    params = params or {}
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        logger.info(f"Starting {name} ingestion {params}")
+        provider = get_provider(name)
+        records = provider.records(**params)
+        if not records:
+            outcome = 'empty'
+            logger.warning(f"No {name} data available")
+            return {'provider': name, 'params': params, 'items': 0, 'inserted': 0, 'deduplicated': 0,
+                    'seconds': round(time.perf_counter() - started, 3)}
+
+        topic, created = Topic.objects.get_or_create(name=provider.topic)
+        # Store the snapshot unless identical content is already saved
+        inserted = FeedItem.objects.insert_if_absent([
+            FeedItem(topic=topic, **provider.feed_item_fields(records, params))
+        ])
+        schedule_topic_pushes(inserted)
+        outcome = 'inserted' if inserted else 'unchanged'
+        result = {'provider': name, 'params': params, 'items': len(records), 'inserted': len(inserted),
+                  'deduplicated': 1 - len(inserted), 'seconds': round(time.perf_counter() - started, 3)}
+        logger.info(
+            f"{name} feed updated with {len(records)} items in {result['seconds']}s: "
+            f"{result['inserted']} inserted, {result['deduplicated']} deduplicated"
+        )
+        return result
+    except Exception as e:
+        logger.error(f"Error ingesting {name} {params}: {str(e)}", exc_info=True)
+        return {'provider': name, 'params': params, 'error': str(e),
+                'seconds': round(time.perf_counter() - started, 3)}
+    finally:
+        INGEST_RUN_SECONDS.labels(name, outcome).observe(time.perf_counter() - started)
+
+@shared_task(**_time_limits(settings.INGEST_SOFT_TIME_LIMIT))
+def ingest_all_providers_task():
+    """Fan out one ingestion per registered provider and parameter set, run in parallel."""
     try:
-        logger.info("Starting crypto news fetch task")
-        # Get crypto trending data
-        data = get_crypto_trending()
-        
-        # Get or create crypto topic
-        topic, created = Topic.objects.get_or_create(name='crypto')
-        
-        # Create feed item with actual data
-        if data:
-            # Join all trending items into one message
-            content = '\n\n'.join(data)
-            FeedItem.objects.create(
-                topic=topic,
-                title='Crypto Trending Update',
-                content=content,
-                url='https://coingecko.com/en',
-                source='coingecko'
+        jobs = ingestion_jobs()
+        group(
+            ingest_provider_task.signature(
+                (provider.name, params), **_time_limits(provider.soft_time_limit)
             )
-            logger.info(f"Crypto feed updated with {len(data)} items")
-            return f"Crypto feed updated with {len(data)} items"
-        else:
-            logger.warning("No crypto data available")
-            return "No crypto data available"
+            for provider, params in jobs
+        ).apply_async()
+        logger.info(f"Ingestion dispatched: {len(jobs)} jobs")
+        return {'jobs': len(jobs), 'providers': sorted({provider.name for provider, params in jobs})}
     except Exception as e:
-        logger.error(f"Error fetching crypto news: {str(e)}", exc_info=True)
-        return f"Error fetching crypto news: {str(e)}"
+        logger.error(f"Error in ingest_all_providers_task: {str(e)}", exc_info=True)
+        return f"Error dispatching ingestion: {str(e)}"
 
-@shared_task
+@shared_task(**INGEST_TASK)
+def refresh_provider_caches_task():
+    """Refresh provider caches ahead of their soft TTL so commands never wait on upstream APIs."""
+    refreshed = {}
+    for provider, params in ingestion_jobs():
+        key = ' '.join([provider.name, *map(str, params.values())])
+        try:
+            provider.records(force_refresh=True, **params)
+            refreshed[key] = 'ok'
+        except Exception as e:
+            logger.error(f"Error refreshing {key} cache: {str(e)}", exc_info=True)
+            refreshed[key] = f"error: {str(e)}"
+    logger.info(f"Provider caches refreshed: {refreshed}")
+    return refreshed
+
+def _broadcast_plan(plan, **options):
+    """Send a planned broadcast; recipients are claimed batch by batch and undelivered claims released."""
+    logger.info(f"Broadcast planned for {len(plan.topics)} topics")
+
+    result = BroadcastResult()
+    claimed = []
+    checked = 0
+
+    def release_unsent():
+        nonlocal checked
+        sent = {message.subscription_id for message in result.delivered[checked:]}
+        checked = len(result.delivered)
+        release_claims([message for message in claimed if message.subscription_id not in sent])
+        claimed.clear()
+
+    def batches():
+        for batch in pending_batches(plan):
+            claimed.extend(batch)
+            yield batch
+            # Resumed once the batch is sent, before the next one is claimed
+            release_unsent()
+
+    # One event loop and one Bot session for the whole broadcast
+    try:
+        broadcast_batches(batches(), result=result, **options)
+    except SoftTimeLimitExceeded:
+        logger.warning(f"Broadcast stopped by its time limit after {result.sent} messages")
+        raise
+    finally:
+        # Also hands back the rest of a batch a time limit or error cut short
+        release_unsent()
+    result.skipped += plan.skipped
+
+    logger.info(
+        f"Broadcast completed: {result.sent} sent, {result.failed} errors, {result.skipped} skipped, "
+        f"{result.rate_limited} rate limited, {result.throughput:.1f} msg/s"
+    )
+    return result.as_dict()
+
+@shared_task(**BROADCAST_TASK)
 def send_topic_updates_task():
     """Send topic updates to all subscribed users."""
     try:
         logger.info("Starting topic updates broadcast task")
-        bot = Bot(token=BOT_TOKEN)
-        
-        subscriptions = Subscription.objects.select_related('user', 'topic')
-        sent_count = 0
-        error_count = 0
-
-        for sub in subscriptions:
-            topic = sub.topic
-            user = sub.user
-            
-            # Get latest feed item for this topic
-            feed_item = FeedItem.objects.filter(topic=topic).order_by('-created_at').first()
-
-            if feed_item:
-                # Build message text
-                text = f"📰 *{topic.name.capitalize()} Update*\n\n"
-                text += f"{feed_item.title}\n\n"
-                
-                # Add content if available
-                if hasattr(feed_item, 'content') and feed_item.content:
-                    text += f"{feed_item.content}\n\n"
-                
-                text += f"🔗 {feed_item.url}"
-
-                try:
-                    # Run async send_message in sync context
-                    asyncio.run(
-                        bot.send_message(
-                            chat_id=user.telegram_id,
-                            text=text,
-                            parse_mode='Markdown'
-                        )
-                    )
-                    sent_count += 1
-                    logger.debug(f"Sent update to user {user.telegram_id}")
-                except Exception as e:
-                    error_count += 1
-                    logger.error(f"Error sending message to {user.telegram_id}: {e}")
-
-        result = f"Broadcast completed: {sent_count} sent, {error_count} errors"
-        logger.info(result)
-        return result
+        # Render each topic's message once and group recipients by topic
+        return _broadcast_plan(plan_broadcast())
     except Exception as e:
         logger.error(f"Error in send_topic_updates_task: {str(e)}", exc_info=True)
-        return f"Error in broadcast task: {str(e)}"
\ No newline at end of file
+        return f"Error in broadcast task: {str(e)}"
+
+@shared_task(**BROADCAST_TASK)
+def send_slot_updates_task():
+    """Send topic updates to the users whose delivery slot is due, spreading the hourly broadcast."""
+    try:
+        slots = due_delivery_slots()
+        if not slots:
+            return {'slots': [], 'sent': 0}
+        logger.info(f"Starting topic updates broadcast for slots {slots}")
+        result = _broadcast_plan(plan_broadcast(Subscription.objects.filter(user__delivery_slot__in=slots)))
+        result['slots'] = slots
+        return result
+    except Exception as e:
+        logger.error(f"Error in send_slot_updates_task: {str(e)}", exc_info=True)
+        return f"Error in slot broadcast task: {str(e)}"
+
+def schedule_topic_pushes(items):
+    """
+    Queue a push for the topics of newly inserted feed items.
+
+    The first insert for a topic sets a Redis marker and schedules the push
+    TOPIC_PUSH_DEBOUNCE seconds later; inserts until the push starts find the
+    marker and are delivered by that same push. Returns the topic ids scheduled.
+    """
+    scheduled = []
+    if not settings.TOPIC_PUSH_ENABLED:
+        return scheduled
+    for topic_id in {item.topic_id for item in items}:
+        try:
+            # The marker outlives the countdown so a push stuck in a busy queue is not doubled
+            if r.set(PUSH_PENDING_KEY.format(topic_id=topic_id), 1, nx=True, ex=settings.TOPIC_PUSH_DEBOUNCE * 10):
+                push_topic_update_task.apply_async((topic_id,), countdown=settings.TOPIC_PUSH_DEBOUNCE)
+                scheduled.append(topic_id)
+        except Exception as e:
+            # The scheduled broadcast still delivers the item, just later
+            logger.warning(f"Could not schedule a push for topic {topic_id}: {e}")
+    return scheduled
+
+@shared_task(**BROADCAST_TASK)
+def push_topic_update_task(topic_id):
+    """Send a topic's newest item to its subscribers who have not received it yet."""
+    try:
+        # Inserts from now on schedule a new push; this one sends everything stored so far
+        r.delete(PUSH_PENDING_KEY.format(topic_id=topic_id))
+        logger.info(f"Starting push for topic {topic_id}")
+        result = _broadcast_plan(plan_broadcast(topic_ids=[topic_id]))
+        result['topic_id'] = topic_id
+        return result
+    except Exception as e:
+        logger.error(f"Error pushing topic {topic_id}: {str(e)}", exc_info=True)
+        return f"Error in topic push task: {str(e)}"
+
+def subscription_id_ranges(shard_size):
+    """Yield (first_id, last_id) keyset ranges of at most `shard_size` subscriptions."""
+    ids = Subscription.objects.order_by('id').values_list('id', flat=True)
+    first_id = ids.first()
+    while first_id is not None:
+        # Last id of this shard and first id of the next one, in a single query
+        bounds = list(ids.filter(id__gte=first_id)[shard_size - 1:shard_size + 1])
+        if not bounds:
+            yield first_id, None
+            return
+        yield first_id, bounds[0]
+        first_id = bounds[1] if len(bounds) > 1 else None
+
+@shared_task(**_time_limits(settings.BROADCAST_SOFT_TIME_LIMIT))
+def send_topic_updates_sharded_task():
+    """Split subscriptions into id ranges and broadcast them as a chord of shard tasks."""
+    try:
+        total = Subscription.objects.count()
+        if not total:
+            logger.info("No subscriptions to broadcast to")
+            return {'shards': 0}
+
+        # Grow shards when the table would need more than BROADCAST_SHARD_PARALLELISM of them
+        shard_size = max(settings.BROADCAST_SHARD_SIZE, math.ceil(total / settings.BROADCAST_SHARD_PARALLELISM))
+        shards = [
+            send_topic_updates_shard_task.s(first_id, last_id)
+            for first_id, last_id in subscription_id_ranges(shard_size)
+        ]
+        chord(shards)(aggregate_broadcast_results.s())
+
+        logger.info(f"Broadcast dispatched: {total} subscriptions in {len(shards)} shards of up to {shard_size}")
+        return {'shards': len(shards), 'shard_size': shard_size, 'subscriptions': total}
+    except Exception as e:
+        logger.error(f"Error in send_topic_updates_sharded_task: {str(e)}", exc_info=True)
+        return f"Error in sharded broadcast task: {str(e)}"
+
+@shared_task(**BROADCAST_TASK)
+def send_topic_updates_shard_task(first_id, last_id=None):
+    """Broadcast to the subscriptions with ids in [first_id, last_id]."""
+    try:
+        subscriptions = Subscription.objects.filter(id__gte=first_id)
+        if last_id is not None:
+            subscriptions = subscriptions.filter(id__lte=last_id)
+
+        logger.info(f"Starting broadcast shard {first_id}-{last_id}")
+        return _broadcast_plan(plan_broadcast(subscriptions), shared_rate_limit=True)
+    except Exception as e:
+        logger.error(f"Error in broadcast shard {first_id}-{last_id}: {str(e)}", exc_info=True)
+        return {'error': str(e)}
+
+@shared_task
+def aggregate_broadcast_results(results):
+    """Chord callback: sum the counts reported by every shard."""
+    totals = {'shards': len(results), 'failed_shards': 0, 'sent': 0, 'failed': 0, 'skipped': 0,
+              'retried': 0, 'rate_limited': 0}
+    for result in results:
+        if not isinstance(result, dict) or 'error' in result:
+            totals['failed_shards'] += 1
+            continue
+        for key in ('sent', 'failed', 'skipped', 'retried', 'rate_limited'):
+            totals[key] += result.get(key, 0)
+
+    logger.info(
+        f"Sharded broadcast completed: {totals['sent']} sent, {totals['failed']} errors, "
+        f"{totals['skipped']} skipped across {totals['shards']} shards ({totals['failed_shards']} failed)"
+    )
+    return totals
+
+@shared_task(**MAINTENANCE_TASK)
+def prune_feed_items_task():
+    """Delete feed items past their topic's retention window in bounded batches."""
+    try:
+        logger.info("Starting feed item pruning task")
+        deleted = prune_feed_items()
+        logger.info(f"Feed pruning completed: {sum(deleted.values())} items deleted")
+        return deleted
+    except Exception as e:
+        logger.error(f"Error pruning feed items: {str(e)}", exc_info=True)
+        return f"Error pruning feed items: {str(e)}"
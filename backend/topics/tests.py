@@ -1,3 +1,430 @@
-from django.test import TestCase
+import asyncio
+import threading
+import time
+from datetime import timedelta, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+from celery.exceptions import SoftTimeLimitExceeded
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+from subscriptions.models import Subscription
+from topics.broadcast import (
+    SLOT_TICK_KEY, BroadcastEngine, OutgoingMessage, TokenBucket, TopicBroadcast, claim_deliveries, due_delivery_slots,
+    plan_broadcast, release_claims,
+)
+from topics.models import FeedItem, Topic
+from news_providers.records import Article, Coin
+from news_providers.redis_client import r
+from news_providers.registry import PROVIDERS, Provider
+from topics.tasks import _broadcast_plan, send_slot_updates_task
+from users.models import CustomUser
+
+
+class FakeBot:
+    """Records sent messages; `errors` maps a chat id to exceptions raised by its next sends."""
+
+    def __init__(self, errors=None):
+        self.sent = []
+        self.raised_at = []
+        self.errors = {chat_id: list(raised) for chat_id, raised in (errors or {}).items()}
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        raised = self.errors.get(chat_id)
+        if raised:
+            self.raised_at.append(time.monotonic())
+            raise raised.pop(0)
+        self.sent.append((chat_id, time.monotonic()))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+ENGINE_OPTIONS = {'concurrency': 4, 'global_rate': 1000, 'per_chat_rate': 1000, 'max_retries': 2}
+
+
+def _engine(bot, **options):
+    return BroadcastEngine(bot, **{**ENGINE_OPTIONS, **options})
+
+
+def _messages(*chat_ids):
+    return [OutgoingMessage(chat_id, 'update', index, 1) for index, chat_id in enumerate(chat_ids)]
+
+
+class BroadcastEngineTests(SimpleTestCase):
+    async def test_sends_every_message(self):
+        bot = FakeBot()
+        result = await _engine(bot).run(_messages('1', '2', '3'))
+        self.assertEqual(result.sent, 3)
+        self.assertEqual(result.failed, 0)
+        self.assertCountEqual([chat_id for chat_id, _ in bot.sent], ['1', '2', '3'])
+        self.assertEqual(len(result.delivered), 3)
+
+    async def test_forbidden_is_counted_as_failed_and_not_retried(self):
+        bot = FakeBot({'2': [Forbidden('bot was blocked by the user'), Forbidden('again')]})
+        result = await _engine(bot).run(_messages('1', '2', '3'))
+        self.assertEqual(result.sent, 2)
+        self.assertEqual(result.failed, 1)
+        self.assertEqual(result.retried, 0)
+        self.assertNotIn('2', [message.chat_id for message in result.delivered])
+        self.assertEqual(len(bot.errors['2']), 1)
+
+    async def test_retry_after_pauses_every_sender_then_retries(self):
+        bot = FakeBot({'1': [RetryAfter(1)]})
+        result = await _engine(bot, concurrency=2).run(_messages('1', '2', '3', '4'))
+        self.assertEqual(result.sent, 4)
+        self.assertEqual(result.rate_limited, 1)
+        self.assertEqual(result.retried, 1)
+        # Nothing goes out while the pause lasts, whichever worker sends it
+        paused_at = bot.raised_at[0]
+        self.assertTrue(all(sent_at >= paused_at + 0.99 for _, sent_at in bot.sent if sent_at > paused_at))
+        self.assertIn('1', [chat_id for chat_id, _ in bot.sent])
+
+    async def test_soft_time_limit_stops_the_run(self):
+        bot = FakeBot({'2': [SoftTimeLimitExceeded()]})
+        with self.assertRaises(SoftTimeLimitExceeded):
+            # Ten messages fill the queue of a single worker: the producer must not hang
+            await asyncio.wait_for(_engine(bot, concurrency=1).run(_messages(*map(str, range(10)))), 2)
+        self.assertEqual([chat_id for chat_id, _ in bot.sent], ['0', '1'])
+        for task in asyncio.all_tasks() - {asyncio.current_task()}:
+            task.cancel()
+
+    async def test_per_chat_rate_spaces_messages_to_one_chat(self):
+        bot = FakeBot()
+        await _engine(bot, per_chat_rate=10).run(_messages('1', '1', '1', '2'))
+        times = [sent_at for chat_id, sent_at in bot.sent if chat_id == '1']
+        self.assertGreaterEqual(times[-1] - times[0], 0.18)
+        # Other chats are not held back by chat '1'
+        other = next(sent_at for chat_id, sent_at in bot.sent if chat_id == '2')
+        self.assertLess(other - times[0], 0.05)
+
+
+class TokenBucketTests(SimpleTestCase):
+    async def test_refills_at_rate(self):
+        bucket = TokenBucket(rate=50, capacity=1)
+        started = time.monotonic()
+        for _ in range(6):
+            await bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
+    async def test_burst_up_to_capacity(self):
+        bucket = TokenBucket(rate=1, capacity=5)
+        started = time.monotonic()
+        await asyncio.gather(*(bucket.acquire() for _ in range(5)))
+        self.assertLess(time.monotonic() - started, 0.05)
+
+
+class InsertIfAbsentTests(TestCase):
+    def setUp(self):
+        self.topic = Topic.objects.create(name='crypto')
+
+    def _item(self, content, topic=None):
+        return FeedItem(topic=topic or self.topic, title='Update', content=content, url='https://example.com',
+                        source='test')
+
+    def test_unchanged_snapshot_is_not_stored_again(self):
+        self.assertEqual(len(FeedItem.objects.insert_if_absent([self._item('BTC up')])), 1)
+        self.assertEqual(FeedItem.objects.insert_if_absent([self._item('  BTC\nup ')]), [])
+        self.assertEqual(FeedItem.objects.count(), 1)
+
+    def test_duplicates_within_one_call_are_stored_once(self):
+        inserted = FeedItem.objects.insert_if_absent([self._item('BTC up'), self._item('BTC up')])
+        self.assertEqual(len(inserted), 1)
+        self.assertEqual(FeedItem.objects.count(), 1)
+
+    def test_only_rows_actually_inserted_are_returned(self):
+        stored = FeedItem.objects.create(topic=self.topic, title='Update', content='BTC up', url='https://example.com',
+                                         source='test')
+        with self.assertNumQueries(1):
+            inserted = FeedItem.objects.insert_if_absent([self._item('BTC up'), self._item('ETH up')])
+        self.assertEqual([item.content for item in inserted], ['ETH up'])
+        self.assertEqual(set(FeedItem.objects.values_list('id', flat=True)), {stored.id, inserted[0].id})
+        self.assertIsNotNone(inserted[0].created_at)
+
+    def test_same_content_in_another_topic_is_stored(self):
+        other = Topic.objects.create(name='stocks')
+        FeedItem.objects.insert_if_absent([self._item('Markets up')])
+        inserted = FeedItem.objects.insert_if_absent([self._item('Markets up', topic=other)])
+        self.assertEqual(len(inserted), 1)
+
+
+class FeedPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.topic = Topic.objects.create(name='news')
+        self.now = timezone.now().replace(microsecond=0)
+        for hours_ago in range(6):
+            item = FeedItem.objects.create(topic=self.topic, title=f'{hours_ago}h', content=f'item {hours_ago}',
+                                           url='https://example.com', source='test')
+            FeedItem.objects.filter(id=item.id).update(created_at=self.now - timedelta(hours=hours_ago))
+        self.url = reverse('feed-list', args=[self.topic.id])
+
+    def _titles(self, params=None):
+        titles = []
+        response = self.client.get(self.url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            titles += [item['title'] for item in response.data['results']]
+            if not response.data['next']:
+                return titles
+            response = self.client.get(response.data['next'])
+
+    def test_pages_cover_the_feed_newest_first(self):
+        self.assertEqual(self._titles({'page_size': 4}), ['0h', '1h', '2h', '3h', '4h', '5h'])
+
+    def test_items_sharing_a_timestamp_are_not_repeated_or_skipped(self):
+        FeedItem.objects.filter(topic=self.topic).update(created_at=self.now)
+        titles = self._titles({'page_size': 4})
+        self.assertCountEqual(titles, ['0h', '1h', '2h', '3h', '4h', '5h'])
+
+    def test_since_is_inclusive_and_until_exclusive(self):
+        params = {
+            'since': (self.now - timedelta(hours=3)).isoformat(),
+            'until': (self.now - timedelta(hours=1)).isoformat(),
+        }
+        self.assertEqual(self._titles(params), ['2h', '3h'])
+
+    def test_naive_datetimes_are_read_as_utc(self):
+        since = (self.now - timedelta(hours=1)).astimezone(dt_timezone.utc).replace(tzinfo=None)
+        self.assertEqual(self._titles({'since': since.isoformat()}), ['0h', '1h'])
+
+    def test_invalid_datetime_is_rejected(self):
+        response = self.client.get(self.url, {'since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('since', response.data)
+
+
+class SubscriptionViewTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(username='reader', telegram_id='42')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.crypto = Topic.objects.create(name='crypto')
+        self.stocks = Topic.objects.create(name='stocks')
+
+    def _post(self, name, data):
+        return self.client.post(reverse(name), data, format='json')
+
+    def test_subscribe_to_several_topics(self):
+        response = self._post('subscribe', {'topic_ids': [self.crypto.id, self.stocks.id, 999]})
+        self.assertEqual(response.status_code, 201)
+        self.assertCountEqual(response.data['subscribed'], [self.crypto.id, self.stocks.id])
+        self.assertEqual(response.data['not_found'], [999])
+        self.assertEqual(Subscription.objects.filter(user=self.user).count(), 2)
+
+    def test_subscribe_again_reports_already_subscribed(self):
+        self._post('subscribe', {'topic_id': self.crypto.id})
+        response = self._post('subscribe', {'topic_ids': [self.crypto.id, self.stocks.id]})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['subscribed'], [self.stocks.id])
+        self.assertEqual(response.data['already_subscribed'], [self.crypto.id])
+
+        response = self._post('subscribe', {'topic_ids': [self.crypto.id]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['already_subscribed'], [self.crypto.id])
+
+    def test_unsubscribe_from_several_topics(self):
+        self._post('subscribe', {'topic_ids': [self.crypto.id, self.stocks.id]})
+        response = self._post('unsubscribe', {'topic_ids': [self.crypto.id, self.stocks.id]})
+        self.assertEqual(response.status_code, 200)
+        self.assertCountEqual(response.data['unsubscribed'], [self.crypto.id, self.stocks.id])
+        self.assertFalse(Subscription.objects.filter(user=self.user).exists())
+
+        response = self._post('unsubscribe', {'topic_ids': [self.crypto.id]})
+        self.assertEqual(response.data['not_subscribed'], [self.crypto.id])
+        self.assertIn('info', response.data)
+
+    def test_unknown_topics_only(self):
+        response = self._post('subscribe', {'topic_ids': [998, 999]})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data['not_found'], [998, 999])
+
+    def test_invalid_topic_ids(self):
+        for data in ({'topic_ids': []}, {'topic_ids': 'crypto'}, {'topic_ids': ['x']}, {}):
+            with self.subTest(data=data):
+                self.assertEqual(self._post('subscribe', data).status_code, 400)
+
+
+class ClaimDeliveryTests(TestCase):
+    def setUp(self):
+        self.topic = Topic.objects.create(name='crypto')
+        self.old_item = FeedItem.objects.create(topic=self.topic, title='Old', content='old', url='https://example.com',
+                                                source='test')
+        self.item = FeedItem.objects.create(topic=self.topic, title='New', content='new', url='https://example.com',
+                                            source='test')
+        for telegram_id in ('1', '2', '3', '4'):
+            user = CustomUser.objects.create(username=f'user_{telegram_id}', telegram_id=telegram_id)
+            Subscription.objects.create(user=user, topic=self.topic)
+        self.broadcast = TopicBroadcast(self.topic.id, self.item.id, 'update')
+
+    def _ledger(self):
+        return dict(Subscription.objects.values_list('user__telegram_id', 'last_delivered_item_id'))
+
+    def _send(self, bot, batch_size=2000, **options):
+        return _broadcast_plan(plan_broadcast(batch_size=batch_size), bot=bot, **{**ENGINE_OPTIONS, **options})
+
+    def test_claim_advances_the_ledger_before_sending(self):
+        claimed = claim_deliveries(Subscription.objects.all(), self.broadcast, batch_size=3)
+        self.assertEqual([message.chat_id for message in claimed], ['1', '2', '3'])
+        self.assertTrue(all(message.previous_item_id is None for message in claimed))
+        self.assertEqual(self._ledger(), {'1': self.item.id, '2': self.item.id, '3': self.item.id, '4': None})
+
+    def test_claimed_rows_are_not_claimed_again(self):
+        claim_deliveries(Subscription.objects.all(), self.broadcast)
+        self.assertEqual(claim_deliveries(Subscription.objects.all(), self.broadcast), [])
+
+    def test_undelivered_messages_are_released_to_their_previous_value(self):
+        Subscription.objects.filter(user__telegram_id='2').update(last_delivered_item_id=self.old_item.id)
+        bot = FakeBot({'2': [Forbidden('bot was blocked by the user')], '3': [BadRequest('chat not found')]})
+        result = self._send(bot)
+        self.assertEqual((result['sent'], result['failed']), (2, 2))
+        self.assertEqual(self._ledger(), {'1': self.item.id, '2': self.old_item.id, '3': None, '4': self.item.id})
+
+    def test_release_leaves_rows_a_newer_item_moved_past(self):
+        claimed = claim_deliveries(Subscription.objects.all(), self.broadcast)
+        newer = FeedItem.objects.create(topic=self.topic, title='Newer', content='newer', url='https://example.com',
+                                        source='test')
+        Subscription.objects.filter(user__telegram_id='1').update(last_delivered_item_id=newer.id)
+        self.assertEqual(release_claims(claimed), 3)
+        self.assertEqual(self._ledger(), {'1': newer.id, '2': None, '3': None, '4': None})
+
+    def test_soft_time_limit_hands_back_the_unsent_claims(self):
+        bot = FakeBot({'3': [SoftTimeLimitExceeded()]})
+        with self.assertRaises(SoftTimeLimitExceeded):
+            self._send(bot, batch_size=2, concurrency=1)
+        # The first batch went out; the second was claimed, cut short and released
+        self.assertEqual(self._ledger(), {'1': self.item.id, '2': self.item.id, '3': None, '4': None})
+
+
+class OverlappingClaimTests(TransactionTestCase):
+    def test_rows_claimed_by_another_broadcast_are_skipped(self):
+        topic = Topic.objects.create(name='crypto')
+        item = FeedItem.objects.create(topic=topic, title='New', content='new', url='https://example.com',
+                                       source='test')
+        for telegram_id in ('1', '2'):
+            user = CustomUser.objects.create(username=f'user_{telegram_id}', telegram_id=telegram_id)
+            Subscription.objects.create(user=user, topic=topic)
+        broadcast = TopicBroadcast(topic.id, item.id, 'update')
+        claimed, release = threading.Event(), threading.Event()
+
+        def hold_claim():
+            # Claim in a transaction that stays open, like a broadcast that has not committed yet
+            try:
+                with transaction.atomic():
+                    claim_deliveries(Subscription.objects.all(), broadcast)
+                    claimed.set()
+                    release.wait(5)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=hold_claim)
+        thread.start()
+        try:
+            self.assertTrue(claimed.wait(5))
+            started = time.monotonic()
+            self.assertEqual(claim_deliveries(Subscription.objects.all(), broadcast), [])
+            self.assertLess(time.monotonic() - started, 1)
+        finally:
+            release.set()
+            thread.join()
+
+
+# Start of a UTC hour, in seconds
+HOUR = 480_000 * 3600
+
+
+class DeliverySlotTests(SimpleTestCase):
+    def setUp(self):
+        r.delete(SLOT_TICK_KEY)
+        self.addCleanup(r.delete, SLOT_TICK_KEY)
+
+    def test_first_tick_delivers_the_current_slot(self):
+        self.assertEqual(due_delivery_slots(HOUR + 5 * 60 + 30), [5])
+
+    def test_repeated_tick_in_the_same_minute_delivers_nothing(self):
+        due_delivery_slots(HOUR + 5 * 60)
+        self.assertEqual(due_delivery_slots(HOUR + 5 * 60 + 59), [])
+
+    def test_missed_ticks_are_caught_up(self):
+        due_delivery_slots(HOUR + 5 * 60)
+        self.assertEqual(due_delivery_slots(HOUR + 9 * 60), [6, 7, 8, 9])
+        self.assertEqual(due_delivery_slots(HOUR + 61 * 60), list(range(10, 60)) + [0, 1])
+
+    def test_catch_up_covers_at_most_one_hour(self):
+        due_delivery_slots(HOUR)
+        self.assertEqual(due_delivery_slots(HOUR + 3 * 3600 + 30 * 60), list(range(31, 60)) + list(range(31)))
+
+
+class SlotBroadcastTests(TestCase):
+    def setUp(self):
+        topic = Topic.objects.create(name='crypto')
+        self.item = FeedItem.objects.create(topic=topic, title='New', content='new', url='https://example.com',
+                                            source='test')
+        for telegram_id, minute in (('1', 5), ('2', 6), ('3', 7)):
+            user = CustomUser.objects.create(username=f'user_{telegram_id}', telegram_id=telegram_id,
+                                             preferred_delivery_minute=minute)
+            Subscription.objects.create(user=user, topic=topic)
+        self.bot = FakeBot()
+
+    def _run(self, slots):
+        with mock.patch('topics.tasks.due_delivery_slots', return_value=slots), \
+                mock.patch('topics.tasks._broadcast_plan',
+                           side_effect=lambda plan: _broadcast_plan(plan, bot=self.bot, **ENGINE_OPTIONS)):
+            return send_slot_updates_task()
+
+    def test_only_users_in_due_slots_are_sent_to(self):
+        result = self._run([5, 6])
+        self.assertEqual((result['slots'], result['sent']), ([5, 6], 2))
+        self.assertEqual(sorted(chat_id for chat_id, _ in self.bot.sent), ['1', '2'])
+        self.assertEqual(Subscription.objects.get(user__telegram_id='3').last_delivered_item_id, None)
+
+    def test_no_due_slot_sends_nothing(self):
+        self.assertEqual(self._run([]), {'slots': [], 'sent': 0})
+        self.assertEqual(self.bot.sent, [])
+
+
+class ProviderRecordsViewTests(SimpleTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.calls = []
+
+        def records(category='business'):
+            self.calls.append(category)
+            if category == 'broken':
+                raise ConnectionError('upstream down')
+            return (Coin('Bitcoin', 'btc', 1, 1.0), Article(f'{category} headline', 'test', 'https://example.com'))
+
+        provider = Provider(name='test', topic='test', records=records, title='Test', url='https://example.com',
+                            source='test', params=lambda: [{'category': 'business'}, {'category': 'broken'}])
+        patcher = mock.patch.dict(PROVIDERS, {'test': provider})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _get(self, name='test', **params):
+        return self.client.get(reverse('provider-records', args=[name]), params)
+
+    def test_records_are_rendered_as_json(self):
+        response = self._get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'provider': 'test', 'params': {'category': 'business'}, 'records': [
+            {'type': 'coin', 'name': 'Bitcoin', 'symbol': 'btc', 'market_cap_rank': 1, 'price_btc': 1.0},
+            {'type': 'article', 'title': 'business headline', 'source': 'test', 'url': 'https://example.com',
+             'description': ''},
+        ]})
+
+    def test_only_ingested_parameter_sets_are_accepted(self):
+        self.assertEqual(self._get(category='sports').status_code, 400)
+        self.assertEqual(self.calls, [])
+
+    def test_unknown_provider_is_not_found(self):
+        self.assertEqual(self._get('weather').status_code, 404)
+
+    def test_unavailable_data_is_reported(self):
+        self.assertEqual(self._get(category='broken').status_code, 503)
@@ -1,5 +1,7 @@
 from django.urls import path
-from .views import TopicListView, MySubscriptionsView, SubscribeView, UnsubscribeView, FeedListView
+from .views import (
+    TopicListView, MySubscriptionsView, SubscribeView, UnsubscribeView, FeedListView, ProviderRecordsView,
+)
 
 urlpatterns = [
     path('topics/', TopicListView.as_view(), name='topic-list'),
@@ -7,4 +9,5 @@ urlpatterns = [
     path('subscribe/', SubscribeView.as_view(), name='subscribe'),
     path('unsubscribe/', UnsubscribeView.as_view(), name='unsubscribe'),
     path('topics/<int:topic_id>/feed/', FeedListView.as_view(), name='feed-list'),
+    path('providers/<str:name>/', ProviderRecordsView.as_view(), name='provider-records'),
 ]
\ No newline at end of file
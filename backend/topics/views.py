@@ -1,12 +1,23 @@
+import logging
+from datetime import timezone as dt_timezone
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from rest_framework import generics, status
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from news_providers.registry import get_provider
+from news_providers.rendering import render_json
 from .models import Topic, FeedItem
 from subscriptions.models import Subscription
+from .pagination import FeedCursorPagination
 from .serializers import TopicSerializer, FeedItemSerializer, SubscriptionSerializer
 from users.models import CustomUser
 
+logger = logging.getLogger(__name__)
+
 class TopicListView(generics.ListAPIView):
     queryset = Topic.objects.all()
     serializer_class = TopicSerializer
@@ -18,41 +29,114 @@ class MySubscriptionsView(generics.ListAPIView):
         user = self.request.user
         return Subscription.objects.filter(user=user)
 
+def _topic_ids(request):
+    """
+    Topic ids from the request body: a `topic_ids` list, or a single `topic_id`.
+
+    Returns {topic id: name} for the topics that exist plus the ids that don't,
+    using one query however many topics are given.
+    """
+    raw = request.data.get('topic_ids')
+    if raw is None:
+        raw = [request.data.get('topic_id')]
+    if not isinstance(raw, list) or not raw:
+        raise ValidationError({'topic_ids': 'Expected a non-empty list of topic ids.'})
+    try:
+        topic_ids = list(dict.fromkeys(int(topic_id) for topic_id in raw))
+    except (TypeError, ValueError):
+        raise ValidationError({'topic_ids': 'Topic ids must be integers.'})
+
+    topics = dict(Topic.objects.filter(id__in=topic_ids).values_list('id', 'name'))
+    return topics, [topic_id for topic_id in topic_ids if topic_id not in topics]
+
 class SubscribeView(APIView):
     def post(self, request):
         user = request.user
-        topic_id = request.data.get('topic_id')
-
-        try:
-            topic = Topic.objects.get(id=topic_id)
-        except Topic.DoesNotExist:
-            return Response({'error': 'Topic not found'}, status=status.HTTP_404_NOT_FOUND)
-
-        subscription, created = Subscription.objects.get_or_create(user=user, topic=topic)
+        topics, not_found = _topic_ids(request)
+        if not topics:
+            return Response({'error': 'Topic not found', 'not_found': not_found}, status=status.HTTP_404_NOT_FOUND)
 
+        created = Subscription.objects.subscribe(user.pk, topics)
+        result = {
+            'subscribed': [topic_id for topic_id in topics if topic_id in created],
+            'already_subscribed': [topic_id for topic_id in topics if topic_id not in created],
+            'not_found': not_found,
+        }
         if created:
-            return Response({'message': 'Subscribed to topic'}, status=status.HTTP_201_CREATED)
+            return Response({'message': 'Subscribed to topics', **result}, status=status.HTTP_201_CREATED)
         else:
-            return Response({'message': 'Already subscribed to topic'}, status=status.HTTP_200_OK)
+            return Response({'message': 'Already subscribed to topics', **result}, status=status.HTTP_200_OK)
 
 class UnsubscribeView(APIView):
     def post(self, request):
         user = request.user
-        topic_id = request.data.get('topic_id')
-
-        try:
-            topic = Topic.objects.get(id=topic_id)
-        except Topic.DoesNotExist:
-            return Response({'error': 'Topic not found'}, status=status.HTTP_404_NOT_FOUND)
+        topics, not_found = _topic_ids(request)
+        if not topics:
+            return Response({'error': 'Topic not found', 'not_found': not_found}, status=status.HTTP_404_NOT_FOUND)
 
-        deleted = Subscription.objects.filter(user=user, topic=topic).delete()
-        if deleted[0]:
-            return Response({'success': f'Unsubscribed from {topic.name}'})
-        return Response({'info': 'Not subscribed'})
+        removed = Subscription.objects.unsubscribe(user.pk, topics)
+        result = {
+            'unsubscribed': [topic_id for topic_id in topics if topic_id in removed],
+            'not_subscribed': [topic_id for topic_id in topics if topic_id not in removed],
+            'not_found': not_found,
+        }
+        if removed:
+            names = ', '.join(topics[topic_id] for topic_id in result['unsubscribed'])
+            return Response({'success': f'Unsubscribed from {names}', **result})
+        return Response({'info': 'Not subscribed', **result})
 
 class FeedListView(generics.ListAPIView):
     serializer_class = FeedItemSerializer
+    pagination_class = FeedCursorPagination
 
     def get_queryset(self):
         topic_id = self.kwargs['topic_id']
-        return FeedItem.objects.filter(topic_id=topic_id).order_by('-created_at')
\ No newline at end of file
+        queryset = FeedItem.objects.filter(topic_id=topic_id)
+
+        since = self._datetime_param('since')
+        if since:
+            queryset = queryset.filter(created_at__gte=since)
+        until = self._datetime_param('until')
+        if until:
+            queryset = queryset.filter(created_at__lt=until)
+
+        # Ordering comes from FeedCursorPagination
+        return queryset
+
+    def _datetime_param(self, name):
+        value = self.request.query_params.get(name)
+        if not value:
+            return None
+        try:
+            parsed = parse_datetime(value)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise ValidationError({name: 'Expected an ISO 8601 datetime, e.g. 2025-12-01T00:00:00Z'})
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed, dt_timezone.utc)
+        return parsed
+
+class ProviderRecordsView(APIView):
+    """A provider's current records as JSON, served from the provider cache."""
+
+    def get(self, request, name):
+        try:
+            provider = get_provider(name)
+        except LookupError as e:
+            raise NotFound(str(e))
+
+        # Only the parameter sets that are ingested, so requests cannot fan out to new upstream calls
+        allowed = provider.params()
+        names = {key for params in allowed for key in params}
+        params = {key: value for key, value in request.query_params.items() if key in names}
+        if params and params not in allowed:
+            raise ValidationError({'params': f'Expected one of {allowed}'})
+        params = params or allowed[0]
+
+        try:
+            records = provider.records(**params)
+        except Exception as e:
+            logger.error(f"Error reading {name} records {params}: {e}", exc_info=True)
+            return Response({'error': 'Provider data is unavailable'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response({'provider': name, 'params': params, 'records': render_json(records)})
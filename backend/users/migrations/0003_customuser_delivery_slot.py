@@ -0,0 +1,40 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:45
+
+import zlib
+
+import django.core.validators
+from django.db import migrations, models
+
+
+def assign_delivery_slots(apps, schema_editor):
+    CustomUser = apps.get_model('users', 'CustomUser')
+    batch = []
+    for user in CustomUser.objects.only('id', 'telegram_id').iterator(chunk_size=2000):
+        user.delivery_slot = zlib.crc32(str(user.telegram_id).encode()) % 60
+        batch.append(user)
+        if len(batch) >= 2000:
+            CustomUser.objects.bulk_update(batch, ['delivery_slot'])
+            batch = []
+    if batch:
+        CustomUser.objects.bulk_update(batch, ['delivery_slot'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_alter_customuser_username'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='preferred_delivery_minute',
+            field=models.PositiveSmallIntegerField(blank=True, null=True, validators=[django.core.validators.MaxValueValidator(59)]),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='delivery_slot',
+            field=models.PositiveSmallIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(assign_delivery_slots, migrations.RunPython.noop),
+    ]
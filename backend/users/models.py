@@ -1,9 +1,33 @@
+import zlib
+
 from django.contrib.auth.models import AbstractUser
+from django.core.validators import MaxValueValidator
 from django.db import models
 
+# Topic updates go out once an hour, spread over one-minute delivery slots
+DELIVERY_SLOTS = 60
+
+
+def delivery_slot_for(telegram_id):
+    """Stable slot for a Telegram id, evenly spread over DELIVERY_SLOTS."""
+    return zlib.crc32(str(telegram_id).encode()) % DELIVERY_SLOTS
+
+
 class CustomUser(AbstractUser):
     telegram_id = models.CharField(max_length=128, unique=True)
     username = models.CharField(max_length=128, unique=True)
+    # Minute of the hour the user asked to get updates at; overrides the hashed slot
+    preferred_delivery_minute = models.PositiveSmallIntegerField(
+        null=True, blank=True, validators=[MaxValueValidator(DELIVERY_SLOTS - 1)]
+    )
+    delivery_slot = models.PositiveSmallIntegerField(default=0, editable=False, db_index=True)
+
+    def save(self, *args, **kwargs):
+        if self.preferred_delivery_minute is not None:
+            self.delivery_slot = self.preferred_delivery_minute
+        else:
+            self.delivery_slot = delivery_slot_for(self.telegram_id)
+        super().save(*args, **kwargs)
 
     def __str__(self):
-        return self.username
\ No newline at end of file
+        return self.username
@@ -0,0 +1,15 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from news_providers.cache import publish_invalidation
+from users.models import CustomUser
+
+
+def user_cache_key(telegram_id):
+    """Key of the bot's cached telegram_id -> user pk entry."""
+    return f'users:telegram_id:{telegram_id}'
+
+
+@receiver(post_delete, sender=CustomUser)
+def invalidate_user(sender, instance, **kwargs):
+    publish_invalidation(user_cache_key(instance.telegram_id))
@@ -1,3 +1,17 @@
 from django.test import TestCase
 
-# Create your tests here.
+from users.models import CustomUser, delivery_slot_for
+
+
+class DeliverySlotTests(TestCase):
+    def test_slot_is_hashed_from_the_telegram_id(self):
+        user = CustomUser.objects.create(username='reader', telegram_id='42')
+        self.assertEqual(user.delivery_slot, delivery_slot_for('42'))
+
+    def test_preferred_minute_overrides_the_hashed_slot(self):
+        user = CustomUser.objects.create(username='reader', telegram_id='42', preferred_delivery_minute=15)
+        self.assertEqual(user.delivery_slot, 15)
+
+        user.preferred_delivery_minute = None
+        user.save()
+        self.assertEqual(CustomUser.objects.get(pk=user.pk).delivery_slot, delivery_slot_for('42'))